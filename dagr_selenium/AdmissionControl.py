@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionControl():
+
+    def __init__(self, queue, high=None, low=None, mode_limits=None, retry_after=30):
+        self.__queue = queue
+        self.__high = int(high) if high else None
+        self.__low = int(low) if low else None
+        self.__mode_limits = mode_limits or dict()
+        self.__retry_after = int(retry_after)
+        self.__throttled = set()
+        self.__changed = asyncio.Event()
+
+    @property
+    def retry_after(self):
+        return self.__retry_after
+
+    def limits(self, mode):
+        high, low = self.__mode_limits.get(mode, (self.__high, self.__low))
+        if high is None:
+            return None, None
+        return high, (int(high * 0.8) if low is None else min(low, high))
+
+    def __set_throttled(self, mode, throttled):
+        if throttled == (mode in self.__throttled):
+            return
+        if throttled:
+            self.__throttled.add(mode)
+            logger.warning(
+                f"Mode {mode} reached high watermark, throttling producers")
+        else:
+            self.__throttled.discard(mode)
+            logger.info(f"Mode {mode} drained to low watermark, admitting producers")
+        self.__changed.set()
+        self.__changed = asyncio.Event()
+
+    def update(self, mode):
+        high, low = self.limits(mode)
+        if high is None:
+            return
+        size = self.__queue.mode_size(mode)
+        if mode in self.__throttled:
+            self.__set_throttled(mode, size > low)
+        else:
+            self.__set_throttled(mode, size >= high)
+
+    def admit(self, modes):
+        for mode in modes:
+            self.update(mode)
+            if mode in self.__throttled:
+                return False
+        return True
+
+    def state(self):
+        modes = set(self.__mode_limits.keys()) | self.__throttled
+        if self.__high is not None:
+            modes.update(self.__queue.mode_counts().keys())
+        state = dict()
+        for mode in sorted(modes):
+            high, low = self.limits(mode)
+            state[mode] = {'size': self.__queue.mode_size(mode), 'high': high,
+                           'low': low, 'throttled': mode in self.__throttled}
+        return state
+
+    async def wait_changed(self, timeout=None):
+        try:
+            await asyncio.wait_for(self.__changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -1,5 +1,7 @@
 import asyncio
 
+from .ItemIndex import ItemIndex
+
 
 class BulkCache():
 
@@ -15,6 +17,7 @@ class BulkCache():
         self.__slug = 'dagr_bulk_cache'
         self.__storage = storage
         self.__contents = dict()
+        self.__index = ItemIndex()
         self.__load_items()
 
     def __load_items(self, items=None):
@@ -24,6 +27,7 @@ class BulkCache():
             if not mode in self.__contents:
                 self.__contents[mode] = set()
             self.__contents[mode].update([i])
+            self.__index.add(ItemIndex.sort_key(mode, item.get('deviant'), item.get('mval')), i)
 
     async def add_item (self, mode, deviant=None, mval=None):
         item = BulkCache.create_item(mode, deviant, mval)
@@ -31,6 +35,7 @@ class BulkCache():
         if not mode in self.__contents:
                 self.__contents[mode] = set()
         self.__contents[mode].update([item])
+        self.__index.add(ItemIndex.sort_key(mode.lower(), deviant, mval), item)
 
     async def add(self, items):
         self.__storage.update(self.__slug, items)
@@ -41,6 +46,10 @@ class BulkCache():
         for item in self.__storage.query(self.__slug):
             yield dict(item)
 
+    def scan(self, after=None, mode=None, deviant_prefix=None):
+        for sort_key, item in self.__index.scan(after, mode, deviant_prefix):
+            yield sort_key, dict(item)
+
     def query(self, mode):
         return (dict(i) for i in self.__contents.get(mode, []))
 
@@ -0,0 +1,94 @@
+import logging
+from json import dumps, loads
+from random import uniform
+from time import time
+
+from .QueueItem import QueueItem
+
+logger = logging.getLogger(__name__)
+
+
+class DeadLetterQueue():
+
+    def __init__(self, storage, max_attempts=5, backoff_base=60, backoff_max=21600):
+        self.__slug = 'dead_letter_items'
+        self.__storage = storage
+        self.__max_attempts = int(max_attempts)
+        self.__backoff_base = float(backoff_base)
+        self.__backoff_max = float(backoff_max)
+        self.__contents = dict()
+        self.__stored = dict()
+        self.__dirty = False
+
+        self.__load_contents()
+
+    def __load_contents(self):
+        for e in self.__storage.query(self.__slug):
+            record = loads(e)
+            key = QueueItem(**record['item']).key
+            self.__contents[key] = record
+            self.__stored[key] = e
+
+    def __store(self, key, record):
+        self.__discard(key)
+        stored = dumps(record, sort_keys=True)
+        self.__contents[key] = record
+        self.__stored[key] = stored
+        self.__storage.update(self.__slug, [stored])
+        self.__dirty = True
+
+    def __discard(self, key):
+        self.__contents.pop(key, None)
+        stored = self.__stored.pop(key, None)
+        if stored is not None:
+            self.__storage.remove(self.__slug, [stored])
+            self.__dirty = True
+
+    def backoff(self, attempts):
+        delay = min(self.__backoff_base * 2 ** (attempts - 1),
+                    self.__backoff_max)
+        return uniform(delay / 2, delay)
+
+    def record_failure(self, item, error=None):
+        key = item.key
+        previous = self.__contents.get(key)
+        attempts = 1 if previous is None else previous['attempts'] + 1
+        record = {
+            'item': item.rip_params,
+            'attempts': attempts,
+            'last_error': error,
+            'failed': time(),
+            'dead': attempts >= self.__max_attempts,
+            'next_eligible': None
+        }
+        if not record['dead']:
+            record['next_eligible'] = time() + self.backoff(attempts)
+        self.__store(key, record)
+        return record
+
+    def clear(self, key):
+        if key in self.__contents:
+            logger.log(level=15, msg=f"Clearing failure record for {key}")
+            self.__discard(key)
+
+    def query(self, dead_only=True):
+        return [r for r in self.__contents.values() if r['dead'] or not dead_only]
+
+    def pop_dead(self, keys=None):
+        if keys is None:
+            keys = [k for k, r in self.__contents.items() if r['dead']]
+        records = []
+        for key in keys:
+            record = self.__contents.get(key)
+            if record is not None and record['dead']:
+                records.append(record)
+                self.__discard(key)
+        return records
+
+    def count(self):
+        return sum(1 for r in self.__contents.values() if r['dead'])
+
+    async def flush(self):
+        if self.__dirty:
+            self.__storage.flush(self.__slug)
+            self.__dirty = False
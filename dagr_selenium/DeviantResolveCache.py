@@ -1,7 +1,10 @@
-import asyncio
+import heapq
 import logging
+from collections import deque
+from os import environ
 from time import time
 from random import randint
+from uuid import uuid4
 
 from dagr_revamped.exceptions import DagrException
 
@@ -9,53 +12,126 @@ logger = logging.getLogger(__name__)
 
 
 class DeviantResolveCache():
+    negative_ttls = {'unresolvable': 3600}
 
-    def __init__(self, storage):
+    def __init__(self, storage, negative_ttls=None):
         self.__slug = 'deviant_resolver_cache'
         self.__storage = storage
+        self.__negative_ttls = {
+            **DeviantResolveCache.negative_ttls,
+            **{r: int(t) for r, t in (i.split(':') for i in environ.get('RESOLVE_NEGATIVE_TTLS', '').split(',') if i)},
+            **(negative_ttls or {})}
+        self.__negative = set()
+        self.__access = dict()
         self.__contents = dict()
+        self.__stored = dict()
+        self.__expiry = []
+        self.__dirty = False
+        self.__hits = 0
+        self.__misses = 0
+        self.__seq = 0
+        self.__epoch = uuid4().hex
+        self.__changes = deque(
+            maxlen=int(environ.get('RESOLVE_CACHE_CHANGES', 10000)))
 
         self.__load_contents()
 
     def __load_contents(self):
-        t_now = time()
         logger.info('Loading deviant resolver cache contents')
-        for entry in (dict(i) for i in self.__storage.query(self.__slug)):
-            if t_now < entry['expiry']:
-                d_lower = entry['resolved'].lower()
-                if not d_lower in self.__contents:
-                    self.__contents[d_lower] = entry
-                elif entry['expiry'] > self.__contents[d_lower]['expiry']:
-                    self.__contents[d_lower] = entry
+        for e in self.__storage.query(self.__slug):
+            self.__index(e, dict(e))
+
+    def __index(self, stored, entry):
+        d_lower = entry['resolved'].lower()
+        self.__stored.setdefault(d_lower, set()).add(stored)
+        heapq.heappush(self.__expiry, (entry['expiry'], d_lower, stored))
+        current = self.__contents.get(d_lower)
+        if current is None or entry['expiry'] > current['expiry']:
+            self.__contents[d_lower] = entry
+            if entry.get('negative'):
+                self.__negative.add(d_lower)
+            else:
+                self.__negative.discard(d_lower)
+
+    def __record_change(self, op, d_lower, entry=None):
+        self.__seq += 1
+        self.__changes.append(
+            {'seq': self.__seq, 'op': op, 'deviant': d_lower, 'entry': entry})
+
+    def changes(self, since=0, epoch=None):
+        if (epoch is None or epoch == self.__epoch) and since <= self.__seq:
+            if self.__changes and since >= self.__changes[0]['seq'] - 1:
+                return {'epoch': self.__epoch, 'seq': self.__seq, 'reset': False,
+                        'changes': [c for c in self.__changes if c['seq'] > since]}
+            if since == self.__seq:
+                return {'epoch': self.__epoch, 'seq': self.__seq, 'reset': False, 'changes': []}
+        return {'epoch': self.__epoch, 'seq': self.__seq, 'reset': True,
+                'changes': [{'seq': self.__seq, 'op': 'add', 'deviant': d, 'entry': e} for d, e in self.__contents.items()]}
+
+    @staticmethod
+    def resolve_entry(entry):
+        if entry.get('deactivated'):
+            raise DagrException('Deviant is deactivated')
+        if entry.get('negative'):
+            raise DagrException(
+                f"Deviant could not be resolved: {entry['negative']}")
+        return entry['resolved']
+
+    @property
+    def hits(self):
+        return self.__hits
+
+    @property
+    def misses(self):
+        return self.__misses
 
     def query_raw(self, deviant):
         return self.__contents.get(deviant.lower(), None)
 
     def query(self, deviant):
-        entry = self.__contents.get(deviant.lower(), None)
-        if entry:
+        d_lower = deviant.lower()
+        entry = self.__contents.get(d_lower, None)
+        if entry and time() < entry['expiry']:
             logger.info('Resolve cache hit')
-            if entry.get('deactivated'):
-                raise DagrException('Deviant is deactivated')
-            if entry:
-                return entry['resolved']
+            self.__hits += 1
+            self.__access[d_lower] = self.__access.get(d_lower, 0) + 1
+            return DeviantResolveCache.resolve_entry(entry)
         logger.info('Resolve cache miss')
+        self.__misses += 1
         return None
 
     async def prune(self):
         t_now = time()
         prune_items = set()
-        for e in self.__storage.query(self.__slug):
-            entry = dict(e)
-            if t_now > (entry['expiry']):
-                deviant = entry['resolved'].lower()
-                prune_items.update([e])
-                if deviant in self.__contents:
-                    del self.__contents[deviant]
-                logger.info(f"Pruning expired {e} entry")
-            await asyncio.sleep(0)
+        while self.__expiry and self.__expiry[0][0] <= t_now:
+            _expiry, d_lower, stored = heapq.heappop(self.__expiry)
+            stored_items = self.__stored.get(d_lower)
+            if stored_items is None or not stored in stored_items:
+                continue
+            logger.info(f"Pruning expired {stored} entry")
+            stored_items.discard(stored)
+            if not stored_items:
+                del self.__stored[d_lower]
+            prune_items.add(stored)
+            current = self.__contents.get(d_lower)
+            if current is not None and current['expiry'] <= t_now:
+                del self.__contents[d_lower]
+                self.__negative.discard(d_lower)
+                self.__access.pop(d_lower, None)
+                self.__record_change('remove', d_lower)
         self.remove(prune_items)
 
+    def refresh_candidates(self, ahead, limit, min_hits=1):
+        horizon = time() + ahead
+        candidates = []
+        for d_lower, count in self.__access.items():
+            entry = self.__contents.get(d_lower)
+            if entry is None or entry.get('deactivated') or entry.get('negative'):
+                continue
+            if count >= min_hits and entry['expiry'] <= horizon:
+                candidates.append((count, entry['resolved']))
+        return [resolved for _count, resolved in heapq.nlargest(limit, candidates)]
+
     def add(self, deviant, deactivated=False):
         entry = {
             'resolved': deviant,
@@ -65,27 +141,57 @@ class DeviantResolveCache():
         if deactivated:
             entry['deactivated'] = True
 
-        self.__contents[deviant.lower()] = entry
-        self.__storage.update(self.__slug, set([tuple(entry.items())]))
+        return self.__store(deviant, entry)
+
+    def add_negative(self, deviant, reason='unresolvable'):
+        ttl = self.__negative_ttls.get(
+            reason, self.__negative_ttls['unresolvable'])
+        entry = {
+            'resolved': deviant,
+            'expiry': time() + randint(ttl // 2, ttl),
+            'negative': reason
+        }
+        logger.log(
+            level=15, msg=f"Caching {deviant} as {reason} for up to {ttl} seconds")
+        return self.__store(deviant, entry)
+
+    def __store(self, deviant, entry):
+        d_lower = deviant.lower()
+        self.remove(self.__stored.pop(d_lower, set()))
+        self.__contents.pop(d_lower, None)
+        self.__access.pop(d_lower, None)
+        stored = tuple(entry.items())
+        self.__index(stored, entry)
+        self.__storage.update(self.__slug, set([stored]))
+        self.__dirty = True
+        self.__record_change('add', d_lower, entry)
+        return entry
 
     def remove(self, items):
         remove_count = len(items)
         if remove_count > 0:
             logger.log(level=15, msg=f"Removing {remove_count} items")
             self.__storage.remove(self.__slug, items)
+            self.__dirty = True
 
     def purge(self, deviant):
         d_lower = deviant.lower()
-        remove_items = set()
         logger.log(level=15, msg=f"Purging {deviant} items")
-        for e in self.__storage.query(self.__slug):
-            entry = dict(e)
-            if entry['resolved'].lower() == d_lower:
-                remove_items.update([e])
-        self.remove(remove_items)
+        self.__contents.pop(d_lower, None)
+        self.__negative.discard(d_lower)
+        self.__access.pop(d_lower, None)
+        self.remove(self.__stored.pop(d_lower, set()))
+        self.__record_change('remove', d_lower)
+
+    def purge_negative(self, deviants=None):
+        d_lowers = set(self.__negative) if deviants is None else set(
+            d.lower() for d in deviants) & self.__negative
+        for d_lower in list(d_lowers):
+            self.purge(d_lower)
+        return len(d_lowers)
 
     async def flush(self):
-        self.__load_contents()
         await self.prune()
-        self.__storage.flush(self.__slug)
-
+        if self.__dirty:
+            self.__storage.flush(self.__slug)
+            self.__dirty = False
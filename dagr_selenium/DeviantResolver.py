@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from dagr_revamped.exceptions import DagrException
+
+from .utils import query_resolve_cache, resolve_query_deviantart
+
+logger = logging.getLogger(__name__)
+
+
+class DeviantResolver():
+
+    def __init__(self, manager, resolve_cache):
+        self.__manager = manager
+        self.__resolve_cache = resolve_cache
+        self.__executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='resolver')
+        self.__inflight = dict()
+
+    @property
+    def inflight(self):
+        return len(self.__inflight)
+
+    async def __lookup(self, deviant, cache_failures):
+        return await resolve_query_deviantart(self.__manager, self.__resolve_cache, deviant, cache_failures, self.__executor)
+
+    async def resolve(self, deviant):
+        if cached_result := await query_resolve_cache(self.__resolve_cache, deviant):
+            return cached_result
+        return await self.__join(deviant)
+
+    async def refresh(self, deviant):
+        logger.log(level=15, msg=f"Refreshing resolve cache entry for {deviant}")
+        return await self.__join(deviant, cache_failures=False)
+
+    async def __join(self, deviant, cache_failures=True):
+        d_lower = deviant.lower()
+        task = self.__inflight.get(d_lower)
+        if task is None:
+            task = asyncio.ensure_future(self.__lookup(deviant, cache_failures))
+            self.__inflight[d_lower] = task
+
+            def done_callback(_task):
+                if self.__inflight.get(d_lower) is task:
+                    del self.__inflight[d_lower]
+            task.add_done_callback(done_callback)
+        else:
+            logger.log(level=15, msg=f"Joining in flight lookup for {deviant}")
+        return await asyncio.shield(task)
+
+    async def resolve_many(self, deviants):
+        distinct = dict()
+        for d in deviants:
+            distinct.setdefault(d.lower(), d)
+        results = await asyncio.gather(*(self.resolve(d) for d in distinct.values()), return_exceptions=True)
+        resolved = dict()
+        for d_lower, result in zip(distinct.keys(), results):
+            if isinstance(result, BaseException) and not isinstance(result, DagrException):
+                raise result
+            resolved[d_lower] = result
+        return resolved
+
+    def shutdown(self):
+        self.__executor.shutdown(wait=False)
@@ -0,0 +1,401 @@
+import asyncio
+import heapq
+import logging
+from collections import deque
+from itertools import count
+from time import time
+
+from .ItemIndex import ItemIndex
+
+logger = logging.getLogger(__name__)
+
+
+class IndexedQueue():
+
+    def __init__(self, aging=None, weights=None, cost=None):
+        self.__aging = float(aging) if aging else None
+        self.__weights = weights or None
+        self.__cost = cost
+        self.__credits = dict()
+        self.__epoch = time()
+        self.__heaps = dict()
+        self.__ready = dict()
+        self.__delayed_heap = []
+        self.__index = dict()
+        self.__item_index = ItemIndex()
+        self.__delayed = dict()
+        self.__delayed_modes = dict()
+        self.__parked = dict()
+        self.__garbage = 0
+        self.__seq = count()
+        self.__uid = count()
+        self.__getter_seq = count()
+        self.__getters = deque()
+        self.__timer = None
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __contains__(self, key):
+        return key in self.__index
+
+    def qsize(self):
+        return len(self.__index)
+
+    def delayed_count(self):
+        return len(self.__delayed)
+
+    def ready_count(self, modes=None):
+        if modes is None:
+            return len(self.__index) - len(self.__delayed)
+        return sum(self.__ready.get(m, 0) for m in modes)
+
+    def mode_size(self, mode):
+        return self.__ready.get(mode, 0) + self.__delayed_modes.get(mode, 0)
+
+    def mode_counts(self):
+        return {m: c for m, c in self.__ready.items() if c > 0}
+
+    def empty(self, modes=None):
+        return self.ready_count(modes) == 0
+
+    def query(self, key):
+        entry = self.__index.get(key)
+        return None if entry is None else entry[-1]
+
+    def items(self):
+        return (entry[-1] for entry in self.__index.values())
+
+    def scan(self, after=None, mode=None, deviant_prefix=None):
+        for sort_key, key in self.__item_index.scan(after, mode, deviant_prefix):
+            entry = self.__index.get(key)
+            if entry is not None:
+                yield sort_key, entry[-1]
+
+    def __rank(self, item, enqueued):
+        rank = item.priority
+        if self.__aging is not None:
+            rank += (enqueued - self.__epoch) / self.__aging
+        return rank
+
+    def __item_cost(self, item):
+        return 0 if self.__cost is None else self.__cost(item)
+
+    def __push_ready(self, item, seq, enqueued):
+        entry = [self.__rank(item, enqueued), self.__item_cost(item),
+                 seq, next(self.__uid), enqueued, item]
+        self.__index[item.key] = entry
+        heapq.heappush(self.__heaps.setdefault(item.mode, []), entry)
+        self.__ready[item.mode] = self.__ready.get(item.mode, 0) + 1
+        return entry
+
+    def __push(self, item, seq=None, enqueued=None):
+        seq = next(self.__seq) if seq is None else seq
+        self.__item_index.add(ItemIndex.sort_key(*item.key), item.key)
+        if enqueued is None:
+            enqueued = item.queued_at or time()
+        if item.not_before is not None and item.not_before > time():
+            entry = [item.not_before, 0, seq, next(self.__uid), item.not_before, item]
+            self.__index[item.key] = entry
+            self.__delayed[item.key] = entry
+            self.__delayed_modes[item.mode] = self.__delayed_modes.get(
+                item.mode, 0) + 1
+            heapq.heappush(self.__delayed_heap, entry)
+            if self.__delayed_heap[0] is entry:
+                self.__schedule_promote()
+            return entry
+        return self.__push_ready(item, seq, enqueued)
+
+    def __invalidate(self, key):
+        entry = self.__index.pop(key)
+        item = entry[-1]
+        if self.__delayed.pop(key, None) is None:
+            self.__ready[item.mode] -= 1
+        else:
+            self.__delayed_modes[item.mode] -= 1
+        entry[-1] = None
+        self.__garbage += 1
+        if self.__garbage > len(self.__index) + 64:
+            self.__collect_garbage()
+        return entry, item
+
+    def __replace(self, key, item):
+        was_delayed = key in self.__delayed
+        old_entry, _item = self.__invalidate(key)
+        enqueued = None if was_delayed else old_entry[4]
+        return self.__push(item, old_entry[2], enqueued)
+
+    def __collect_garbage(self):
+        for mode, heap in self.__heaps.items():
+            self.__heaps[mode] = [e for e in heap if e[-1] is not None]
+            heapq.heapify(self.__heaps[mode])
+        self.__delayed_heap = [
+            e for e in self.__delayed_heap if e[-1] is not None]
+        heapq.heapify(self.__delayed_heap)
+        for deviant, entries in list(self.__parked.items()):
+            entries = [e for e in entries if e[-1] is not None]
+            if entries:
+                self.__parked[deviant] = entries
+            else:
+                del self.__parked[deviant]
+        self.__garbage = 0
+
+    def __schedule_promote(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        while self.__delayed_heap and self.__delayed_heap[0][-1] is None:
+            heapq.heappop(self.__delayed_heap)
+            self.__garbage -= 1
+        if self.__delayed_heap:
+            delay = max(self.__delayed_heap[0][0] - time(), 0)
+            self.__timer = asyncio.get_running_loop().call_later(delay, self.__on_timer)
+
+    def __on_timer(self):
+        self.__timer = None
+        for mode in self.__promote_due():
+            self.__wakeup_next(mode)
+        self.__schedule_promote()
+
+    def __promote_due(self):
+        promoted = []
+        t_now = time()
+        while self.__delayed_heap and self.__delayed_heap[0][0] <= t_now:
+            entry = heapq.heappop(self.__delayed_heap)
+            item = entry[-1]
+            if item is None:
+                self.__garbage -= 1
+                continue
+            del self.__delayed[item.key]
+            self.__delayed_modes[item.mode] -= 1
+            self.__push_ready(item, entry[2], entry[4])
+            promoted.append(item.mode)
+        if promoted:
+            logger.log(level=15, msg=f"Promoted {len(promoted)} delayed items")
+        return promoted
+
+    def __wakeup_next(self, mode, after=None):
+        for getter in self.__getters:
+            order, waiter, modes = getter
+            if after is not None and order <= after:
+                continue
+            if not waiter.done() and (modes is None or mode in modes):
+                self.__getters.remove(getter)
+                waiter.set_result(mode)
+                return
+
+    def __add_getter(self, getter):
+        i = len(self.__getters)
+        while i > 0 and self.__getters[i - 1][0] > getter[0]:
+            i -= 1
+        self.__getters.insert(i, getter)
+
+    def __head(self, mode):
+        heap = self.__heaps.get(mode)
+        while heap and heap[0][-1] is None:
+            heapq.heappop(heap)
+            self.__garbage -= 1
+        return heap[0] if heap else None
+
+    def __eligible_head(self, mode, exclude):
+        head = self.__head(mode)
+        if not exclude:
+            return head
+        while head is not None and head[-1].exclusive_key in exclude:
+            heapq.heappop(self.__heaps[mode])
+            self.__parked.setdefault(
+                head[-1].exclusive_key, []).append(head)
+            head = self.__head(mode)
+        return head
+
+    def __unpark(self, exclude):
+        for deviant in [d for d in self.__parked if not exclude or not d in exclude]:
+            for entry in self.__parked.pop(deviant):
+                if entry[-1] is None:
+                    self.__garbage -= 1
+                else:
+                    heapq.heappush(self.__heaps[entry[-1].mode], entry)
+
+    def notify_all(self):
+        while self.__getters:
+            _order, waiter, _modes = self.__getters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def put_nowait(self, item):
+        key = item.key
+        entry = self.__index.get(key)
+        if entry is None:
+            self.__push(item)
+            if not key in self.__delayed:
+                self.__wakeup_next(item.mode)
+            return item, None
+        existing = entry[-1]
+        merged = existing.merge(item)
+        if merged is existing:
+            logger.log(level=15, msg=f"Item {key} already queued")
+            return existing, None
+        self.__replace(key, merged)
+        if key in self.__delayed:
+            self.__schedule_promote()
+        else:
+            self.__wakeup_next(merged.mode)
+        logger.log(level=15, msg=f"Merged duplicate item {key}")
+        return merged, existing
+
+    def load(self, items):
+        conflicts = []
+        added = dict()
+        delayed = []
+        t_now = time()
+        for item in items:
+            key = item.key
+            if key in self.__index:
+                conflicts.append(item)
+                continue
+            seq = next(self.__seq)
+            self.__item_index.add(ItemIndex.sort_key(*key), key)
+            if item.not_before is not None and item.not_before > t_now:
+                entry = [item.not_before, 0, seq, next(self.__uid), item.not_before, item]
+                self.__delayed[key] = entry
+                self.__delayed_modes[item.mode] = self.__delayed_modes.get(
+                    item.mode, 0) + 1
+                delayed.append(entry)
+            else:
+                enqueued = item.queued_at or t_now
+                entry = [self.__rank(item, enqueued), self.__item_cost(item),
+                         seq, next(self.__uid), enqueued, item]
+                added.setdefault(item.mode, []).append(entry)
+            self.__index[key] = entry
+        for mode, entries in added.items():
+            self.__ready[mode] = self.__ready.get(mode, 0) + len(entries)
+            self.__heaps[mode] = self.__extend_heap(
+                self.__heaps.get(mode, []), entries)
+        if delayed:
+            self.__delayed_heap = self.__extend_heap(
+                self.__delayed_heap, delayed)
+            self.__schedule_promote()
+        for mode, entries in added.items():
+            for _i in range(min(len(entries), len(self.__getters))):
+                self.__wakeup_next(mode)
+        return conflicts
+
+    @staticmethod
+    def __extend_heap(heap, entries):
+        if len(entries) * 8 < len(heap):
+            for entry in entries:
+                heapq.heappush(heap, entry)
+            return heap
+        heap.extend(entries)
+        heapq.heapify(heap)
+        return heap
+
+    async def put(self, item):
+        return self.put_nowait(item)
+
+    def __pick_weighted(self, heads):
+        total = 0
+        best = None
+        for mode in heads.keys():
+            weight = self.__weights.get(mode, 1)
+            total += weight
+            self.__credits[mode] = self.__credits.get(mode, 0) + weight
+            if best is None or self.__credits[mode] > self.__credits[best]:
+                best = mode
+        self.__credits[best] -= total
+        return heads[best]
+
+    def get_nowait(self, modes=None, exclude=None):
+        self.__promote_due()
+        if self.__parked:
+            self.__unpark(exclude)
+        heads = dict()
+        for mode in (list(self.__heaps.keys()) if modes is None else modes):
+            head = self.__eligible_head(mode, exclude)
+            if head is not None:
+                heads[mode] = head
+        if not heads:
+            raise asyncio.QueueEmpty()
+        if self.__weights is None:
+            best = min(heads.values(), key=lambda e: e[:4])
+        else:
+            best = self.__pick_weighted(heads)
+        item = best[-1]
+        heap = self.__heaps[item.mode]
+        if heap[0] is best:
+            heapq.heappop(heap)
+        else:
+            best[-1] = None
+            self.__garbage += 1
+        del self.__index[item.key]
+        self.__item_index.discard(ItemIndex.sort_key(*item.key))
+        self.__ready[item.mode] -= 1
+        return item
+
+    def get_many_nowait(self, count, modes=None, exclude=None):
+        items = []
+        if exclude is not None:
+            exclude = set(exclude)
+        while len(items) < count and not self.empty(modes):
+            try:
+                item = self.get_nowait(modes, exclude)
+            except asyncio.QueueEmpty:
+                break
+            items.append(item)
+            if exclude is not None and item.exclusive_key is not None:
+                exclude.add(item.exclusive_key)
+        return items
+
+    async def get(self, modes=None, exclude=None):
+        order = next(self.__getter_seq)
+        woken_by = None
+        while True:
+            if not self.empty(modes):
+                try:
+                    return self.get_nowait(modes, exclude)
+                except asyncio.QueueEmpty:
+                    if woken_by is not None:
+                        self.__wakeup_next(woken_by, order)
+            waiter = asyncio.get_running_loop().create_future()
+            getter = (order, waiter, modes)
+            self.__add_getter(getter)
+            try:
+                woken_by = await waiter
+            except:
+                waiter.cancel()
+                try:
+                    self.__getters.remove(getter)
+                except ValueError:
+                    pass
+                if not waiter.cancelled():
+                    for mode in self.mode_counts().keys():
+                        self.__wakeup_next(mode)
+                raise
+
+    def upgrade(self, key, priority):
+        entry = self.__index.get(key)
+        if entry is None:
+            return None, None
+        if not priority < entry[-1].priority:
+            return entry[-1], None
+        return self.reprioritize(key, priority)
+
+    def reprioritize(self, key, priority):
+        entry = self.__index.get(key)
+        if entry is None:
+            return None, None
+        existing = entry[-1]
+        if priority == existing.priority:
+            return existing, None
+        updated = existing.replace(priority=priority)
+        self.__replace(key, updated)
+        if not key in self.__delayed:
+            self.__wakeup_next(updated.mode)
+        return updated, existing
+
+    def remove(self, key):
+        if not key in self.__index:
+            return None
+        _entry, item = self.__invalidate(key)
+        self.__item_index.discard(ItemIndex.sort_key(*key))
+        return item
@@ -0,0 +1,61 @@
+from bisect import bisect_left, bisect_right
+
+
+class ItemIndex():
+
+    @staticmethod
+    def sort_key(mode, deviant=None, mval=None):
+        return (mode or '', (deviant or '').lower(), mval or '')
+
+    def __init__(self):
+        self.__keys = dict()
+        self.__sorted = []
+        self.__pending = []
+        self.__stale = 0
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def add(self, sort_key, key):
+        if sort_key in self.__keys:
+            return
+        self.__keys[sort_key] = key
+        self.__pending.append(sort_key)
+
+    def discard(self, sort_key):
+        if self.__keys.pop(sort_key, None) is not None:
+            self.__stale += 1
+
+    def __merge(self):
+        if self.__stale > len(self.__keys):
+            self.__sorted = sorted(self.__keys.keys())
+            self.__pending = []
+            self.__stale = 0
+        elif self.__pending:
+            self.__sorted = sorted(self.__sorted + self.__pending)
+            self.__pending = []
+
+    def scan(self, after=None, mode=None, deviant_prefix=None):
+        self.__merge()
+        snapshot = self.__sorted
+        start = 0
+        if mode is not None:
+            start = bisect_left(snapshot, (mode, (deviant_prefix or '').lower()))
+        if after is not None:
+            start = max(start, bisect_right(snapshot, tuple(after)))
+        prefix = None if deviant_prefix is None else deviant_prefix.lower()
+        previous = None
+        for i in range(start, len(snapshot)):
+            sort_key = snapshot[i]
+            if mode is not None and sort_key[0] != mode:
+                return
+            if prefix is not None and not sort_key[1].startswith(prefix):
+                if mode is not None:
+                    return
+                continue
+            if sort_key == previous:
+                continue
+            previous = sort_key
+            key = self.__keys.get(sort_key)
+            if key is not None:
+                yield sort_key, key
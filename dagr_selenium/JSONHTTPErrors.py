@@ -1,6 +1,7 @@
 from json import dumps
 
-from aiohttp.web import HTTPBadRequest, HTTPInternalServerError, HTTPNotFound
+from aiohttp.web import (HTTPBadRequest, HTTPInternalServerError, HTTPNotFound,
+                         HTTPTooManyRequests)
 
 
 class JSONHTTPInternalServerError(HTTPInternalServerError):
@@ -36,3 +37,15 @@ class JSONHTTPNotFound(HTTPNotFound):
         super().__init__(
             headers=headers,  text=dumps(reason), content_type='application/json'
         )
+
+
+class JSONHTTPTooManyRequests(HTTPTooManyRequests):
+    def __init__(
+        self,
+        *,
+        headers=None,
+        reason=None,
+    ) -> None:
+        super().__init__(
+            headers=headers,  text=dumps(reason), content_type='application/json'
+        )
@@ -0,0 +1,76 @@
+import logging
+from json import dumps, loads
+from time import time
+
+logger = logging.getLogger(__name__)
+
+
+class JobStats():
+    fields = ['duration', 'pages', 'bytes']
+
+    def __init__(self, storage, alpha=0.3):
+        self.__slug = 'job_stats'
+        self.__storage = storage
+        self.__alpha = float(alpha)
+        self.__contents = dict()
+        self.__stored = dict()
+        self.__dirty = False
+
+        self.__load_contents()
+
+    def __load_contents(self):
+        for e in self.__storage.query(self.__slug):
+            record = loads(e)
+            key = (record['mode'], record['deviant'], record['mval'])
+            self.__contents[key] = record
+            self.__stored[key] = e
+
+    @staticmethod
+    def stats_key(key):
+        mode, deviant, _mval = key
+        return key if deviant is None else (mode, deviant, None)
+
+    def record(self, item, **stats):
+        key = JobStats.stats_key(item.key)
+        record = self.__contents.get(key)
+        if record is None:
+            record = {'mode': key[0], 'deviant': key[1], 'mval': key[2], 'runs': 0,
+                      **{f: None for f in JobStats.fields}}
+        else:
+            record = record.copy()
+        for field in JobStats.fields:
+            value = stats.get(field)
+            if value is None:
+                continue
+            value = float(value)
+            previous = record.get(field)
+            record[field] = value if previous is None else previous + \
+                self.__alpha * (value - previous)
+        record['runs'] += 1
+        record['updated'] = time()
+        stored = dumps(record, sort_keys=True)
+        previous_stored = self.__stored.get(key)
+        if previous_stored is not None:
+            self.__storage.remove(self.__slug, [previous_stored])
+        self.__storage.update(self.__slug, [stored])
+        self.__contents[key] = record
+        self.__stored[key] = stored
+        self.__dirty = True
+        logger.log(level=15, msg=f"Updated job stats for {key}: {record}")
+        return record
+
+    def query(self, key):
+        return self.__contents.get(JobStats.stats_key(key))
+
+    def expected_duration(self, item):
+        record = self.__contents.get(JobStats.stats_key(item.key))
+        return None if record is None else record.get('duration')
+
+    def cost(self, item):
+        duration = self.expected_duration(item)
+        return 0 if duration is None else duration
+
+    async def flush(self):
+        if self.__dirty:
+            self.__storage.flush(self.__slug)
+            self.__dirty = False
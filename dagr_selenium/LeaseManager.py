@@ -0,0 +1,86 @@
+import heapq
+import logging
+from time import time
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseManager():
+
+    def __init__(self, timeout=900):
+        self.__timeout = int(timeout)
+        self.__leases = dict()
+        self.__expiry = []
+        self.__busy = dict()
+
+    def __len__(self):
+        return len(self.__leases)
+
+    def __contains__(self, lease_id):
+        return lease_id in self.__leases
+
+    @property
+    def busy(self):
+        return self.__busy.keys()
+
+    def __acquire(self, item):
+        deviant = item.exclusive_key
+        if deviant is not None:
+            self.__busy[deviant] = self.__busy.get(deviant, 0) + 1
+
+    def __release(self, item):
+        deviant = item.exclusive_key
+        if deviant is not None:
+            self.__busy[deviant] -= 1
+            if self.__busy[deviant] == 0:
+                del self.__busy[deviant]
+
+    def get(self, lease_id):
+        lease = self.__leases.get(lease_id)
+        return None if lease is None else lease['item']
+
+    def age(self, lease_id):
+        lease = self.__leases.get(lease_id)
+        return None if lease is None else time() - lease['granted']
+
+    def items(self):
+        return (lease['item'] for lease in self.__leases.values())
+
+    def grant(self, item, timeout=None):
+        lease_id = uuid4().hex
+        expiry = time() + (timeout or self.__timeout)
+        self.__leases[lease_id] = {
+            'item': item, 'expiry': expiry, 'granted': time()}
+        self.__acquire(item)
+        heapq.heappush(self.__expiry, (expiry, lease_id))
+        logger.log(level=15, msg=f"Granted lease {lease_id} for {item.key}")
+        return lease_id, expiry
+
+    def extend(self, lease_id, timeout=None):
+        lease = self.__leases.get(lease_id)
+        if lease is None:
+            return None
+        lease['expiry'] = time() + (timeout or self.__timeout)
+        heapq.heappush(self.__expiry, (lease['expiry'], lease_id))
+        return lease['expiry']
+
+    def release(self, lease_id):
+        lease = self.__leases.pop(lease_id, None)
+        if lease is None:
+            return None
+        self.__release(lease['item'])
+        return lease['item']
+
+    def pop_expired(self):
+        t_now = time()
+        expired = []
+        while self.__expiry and self.__expiry[0][0] <= t_now:
+            expiry, lease_id = heapq.heappop(self.__expiry)
+            lease = self.__leases.get(lease_id)
+            if lease is not None and lease['expiry'] == expiry:
+                del self.__leases[lease_id]
+                self.__release(lease['item'])
+                logger.warning(f"Lease {lease_id} for {lease['item'].key} expired")
+                expired.append(lease['item'])
+        return expired
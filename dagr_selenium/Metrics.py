@@ -0,0 +1,113 @@
+import asyncio
+from bisect import bisect_left, bisect_right
+from time import perf_counter
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels.keys(), escaped)) + '}'
+
+
+class Counter():
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.__values = dict()
+
+    def inc(self, *label_values, amount=1):
+        self.__values[label_values] = self.__values.get(
+            label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in self.__values.items():
+            yield f"{self.name}{format_labels(dict(zip(self.labels, label_values)))} {value}"
+
+
+class Histogram():
+    def __init__(self, name, description, buckets, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.__buckets = sorted(buckets)
+        self.__values = dict()
+
+    def observe(self, value, *label_values):
+        series = self.__values.get(label_values)
+        if series is None:
+            series = {'counts': [0] * (len(self.__buckets) + 1), 'sum': 0}
+            self.__values[label_values] = series
+        series['counts'][bisect_left(self.__buckets, value)] += 1
+        series['sum'] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, series in self.__values.items():
+            labels = dict(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip([*self.__buckets, '+Inf'], series['counts']):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels({**labels, 'le': bound})} {cumulative}"
+            yield f"{self.name}_sum{format_labels(labels)} {series['sum']}"
+            yield f"{self.name}_count{format_labels(labels)} {cumulative}"
+
+
+class TimedLock():
+    def __init__(self, histogram):
+        self.__lock = asyncio.Lock()
+        self.__histogram = histogram
+        self.__acquired = None
+
+    def locked(self):
+        return self.__lock.locked()
+
+    async def __aenter__(self):
+        await self.__lock.acquire()
+        self.__acquired = perf_counter()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.__histogram.observe(perf_counter() - self.__acquired)
+        self.__lock.release()
+
+
+class Metrics():
+    priority_bands = [0, 10, 50, 100]
+
+    def __init__(self):
+        self.enqueued = Counter(
+            'dagr_queue_enqueued_total', 'Items submitted to the queue', ['mode'])
+        self.dequeued = Counter(
+            'dagr_queue_dequeued_total', 'Items handed out to workers', ['mode'])
+        self.dequeue_wait = Histogram(
+            'dagr_queue_dequeue_wait_seconds', 'Time dequeue requests waited for an item',
+            [0.001, 0.01, 0.1, 1, 5, 15, 30, 60, 120])
+        self.item_age = Histogram(
+            'dagr_queue_item_age_seconds', 'Time items spent queued before dispatch',
+            [1, 10, 60, 300, 900, 3600, 21600, 86400, 604800], ['mode'])
+        self.lock_hold = Histogram(
+            'dagr_queue_lock_hold_seconds', 'Time queue_lock was held',
+            [0.0001, 0.001, 0.01, 0.05, 0.1, 0.5, 1, 5])
+
+    @staticmethod
+    def priority_band(priority):
+        return Metrics.priority_bands[max(bisect_right(Metrics.priority_bands, priority) - 1, 0)]
+
+    def timed_lock(self):
+        return TimedLock(self.lock_hold)
+
+    def render(self, collected):
+        lines = []
+        for name, kind, description, samples in collected:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        for metric in [self.enqueued, self.dequeued, self.dequeue_wait, self.item_age, self.lock_hold]:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from json import JSONDecodeError, loads
+from queue import Empty, Queue
+from random import random
+
+from aiohttp import ClientError, ClientSession, WSMsgType
+
+logger = logging.getLogger(__name__)
+
+
+class PushSubscriber():
+
+    def __init__(self, url, modes=None, lease=None, reconnect_delay=5, reconnect_max=300):
+        self.__url = url
+        self.__modes = modes
+        self.__lease = lease
+        self.__reconnect_delay = float(reconnect_delay)
+        self.__reconnect_max = float(reconnect_max)
+        self.__items = Queue()
+        self.__loop = None
+        self.__ws = None
+        self.__credit = 0
+        self.__stopped = None
+
+    def __subscribe_message(self):
+        message = {'type': 'subscribe', 'credit': self.__credit}
+        if self.__modes:
+            message['modes'] = self.__modes
+        if self.__lease:
+            message['lease'] = self.__lease
+        return message
+
+    async def run(self, stop_check):
+        self.__loop = asyncio.get_running_loop()
+        self.__stopped = asyncio.Event()
+        delay = self.__reconnect_delay
+        async with ClientSession() as session:
+            while not stop_check():
+                try:
+                    async with session.ws_connect(self.__url, heartbeat=30) as ws:
+                        logger.info(f"Subscribed to {self.__url}")
+                        self.__ws = ws
+                        await ws.send_json(self.__subscribe_message())
+                        delay = self.__reconnect_delay
+                        await self.__receive(ws)
+                except (ClientError, asyncio.TimeoutError):
+                    logger.warning('Push subscription failed', exc_info=True)
+                finally:
+                    self.__ws = None
+                if stop_check():
+                    break
+                jittered = delay * (0.5 + random())
+                logger.info(f"Reconnecting push subscription in {jittered:.1f} seconds")
+                try:
+                    await asyncio.wait_for(self.__stopped.wait(), jittered)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, self.__reconnect_max)
+        logger.info('Push subscription shutdown')
+
+    async def __receive(self, ws):
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            try:
+                message = loads(msg.data)
+            except JSONDecodeError:
+                logger.warning(f"Ignoring invalid push message {msg.data}")
+                continue
+            if message.get('type') == 'item':
+                self.__credit -= 1
+                self.__items.put(message)
+            elif message.get('type') == 'error':
+                logger.warning(f"Push consumer error: {message.get('reason')}")
+
+    async def __add_credit(self, credit):
+        self.__credit += credit
+        if self.__ws is not None and not self.__ws.closed:
+            await self.__ws.send_json({'type': 'credit', 'credit': credit})
+
+    async def __resubscribe(self):
+        if self.__ws is not None and not self.__ws.closed:
+            await self.__ws.send_json(self.__subscribe_message())
+
+    def request(self, credit=1):
+        if self.__loop is None:
+            self.__credit += credit
+            return
+        asyncio.run_coroutine_threadsafe(
+            self.__add_credit(credit), self.__loop).result()
+
+    def fetch(self, timeout):
+        try:
+            return self.__items.get(timeout=timeout)
+        except Empty:
+            self.__resync()
+            return None
+
+    def __resync(self):
+        if self.__loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(
+                self.__resubscribe(), self.__loop).result()
+        except (ClientError, ConnectionError):
+            logger.warning('Unable to resend push credit', exc_info=True)
+
+    async def __close(self):
+        self.__stopped.set()
+        if self.__ws is not None:
+            await self.__ws.close()
+
+    def stop(self):
+        if self.__loop is not None:
+            asyncio.run_coroutine_threadsafe(self.__close(), self.__loop)
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueueCacheWriter():
+
+    def __init__(self, storage, slug, journal, lock, batch_size=500, batch_window=0.5):
+        self.__storage = storage
+        self.__slug = slug
+        self.__journal = journal
+        self.__lock = lock
+        self.__batch_size = int(batch_size)
+        self.__batch_window = float(batch_window)
+        self.__channel = asyncio.Queue()
+        self.__task = None
+
+    @property
+    def backlog(self):
+        return self.__channel.qsize()
+
+    def add(self, params):
+        self.__channel.put_nowait(('add', params))
+
+    def remove(self, params):
+        self.__channel.put_nowait(('remove', params))
+
+    def remove_many(self, items):
+        self.__channel.put_nowait(('remove_many', items))
+
+    def start(self):
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__channel.put_nowait(('stop', None))
+            await self.__task
+            self.__task = None
+
+    async def __collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.__channel.get()]
+        deadline = loop.time() + self.__batch_window
+        while len(batch) < self.__batch_size and batch[-1][0] != 'stop':
+            if not self.__channel.empty():
+                batch.append(self.__channel.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.__channel.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def __run(self):
+        stopping = False
+        while not stopping:
+            batch = await self.__collect()
+            stopping = any(op == 'stop' for op, _params in batch)
+            await self.__apply([(op, params) for op, params in batch if op != 'stop'])
+
+    async def __apply(self, batch):
+        if not batch:
+            return
+        async with self.__lock:
+            logger.log(
+                level=15, msg=f"Writing {len(batch)} queue cache mutations")
+            for op, params in batch:
+                try:
+                    if op == 'add':
+                        self.__storage.update(self.__slug, params)
+                        self.__journal.add(params)
+                    elif op == 'remove':
+                        self.__storage.remove(self.__slug, params)
+                        self.__journal.remove(params)
+                    elif op == 'remove_many':
+                        for p in params:
+                            self.__storage.remove(self.__slug, p)
+                            self.__journal.remove(p)
+                except:
+                    logger.exception(f"Error while applying queue cache {op}")
+            if self.__journal.needs_compact:
+                try:
+                    self.__journal.compact()
+                except:
+                    logger.exception('Error while flushing queue cache')
@@ -1,23 +1,57 @@
 from .functions import rip, update_bookmarks
 from asyncio import Event
+from json import dumps
+from sys import intern
 
 
 class QueueItem():
+    merge_flags = ['full_crawl', 'disable_filter', 'verify_exists',
+                   'verify_best', 'load_more', 'dump_html', 'resolved']
+    schedule_keys = ['not_before', 'queued_at']
+    no_browser_modes = ['art']
+
+    __slots__ = ('__raw', '__params', '__key', '__json', '__complete')
+
     def __init__(self, **kwargs) -> None:
-        self.__raw = kwargs.copy()
+        for k in QueueItem.schedule_keys:
+            if k in kwargs and kwargs[k] is None:
+                del kwargs[k]
+        raw = kwargs.copy()
         mode = kwargs.get('mode', '')
-        kwargs['mode'] = mode.lower() if isinstance(mode, str) else mode
+        kwargs['mode'] = intern(mode.lower()) if isinstance(mode, str) else mode
+        deviant = kwargs.get('deviant')
+        if isinstance(deviant, str):
+            kwargs['deviant'] = intern(deviant)
         kwargs['priority'] = int(kwargs.get('priority', '100'))
+        for k in QueueItem.schedule_keys:
+            if k in kwargs:
+                kwargs[k] = float(kwargs[k])
+        self.__raw = None if raw == kwargs else raw
         self.__params = kwargs
-        self.complete = Event()
+        self.__key = (kwargs['mode'], intern(deviant.lower()) if isinstance(
+            deviant, str) else deviant, kwargs.get('mval'))
+        self.__json = None
+        self.__complete = None
+
+    @property
+    def complete(self):
+        if self.__complete is None:
+            self.__complete = Event()
+        return self.__complete
 
     @property
     def raw_params(self):
-        return self.__raw.copy()
+        return (self.__params if self.__raw is None else self.__raw).copy()
 
     @property
     def params(self):
-        return self.__params.copy()
+        return self.__params
+
+    @property
+    def json(self):
+        if self.__json is None:
+            self.__json = dumps(self.__params)
+        return self.__json
 
     @property
     def mode(self):
@@ -43,33 +77,76 @@ class QueueItem():
     def full_crawl(self):
         return self.__params.get('full_crawl')
 
+    @property
+    def not_before(self):
+        return self.__params.get('not_before')
+
+    @property
+    def queued_at(self):
+        return self.__params.get('queued_at')
+
+    @property
+    def rip_params(self):
+        return {k: v for k, v in self.__params.items() if not k in QueueItem.schedule_keys}
+
     @property
     def config_options(self):
         return self.__params.get('config_options')
 
+    @property
+    def key(self):
+        return self.__key
+
+    @property
+    def exclusive_key(self):
+        if self.mode in QueueItem.no_browser_modes:
+            return None
+        return self.__key[1]
+
+    def merge(self, other):
+        merged = self.__params.copy()
+        for k, v in other.__params.items():
+            if merged.get(k) is None:
+                merged[k] = v
+        for k in QueueItem.merge_flags:
+            if other.__params.get(k):
+                merged[k] = True
+        if other.priority < self.priority:
+            merged['priority'] = other.priority
+        if self.not_before is None or other.not_before is None:
+            merged.pop('not_before', None)
+        else:
+            merged['not_before'] = min(self.not_before, other.not_before)
+        if merged == self.__params:
+            return self
+        return QueueItem(**merged)
+
+    def replace(self, **kwargs):
+        return QueueItem(**{**self.__params, **kwargs})
+
     def __lt__(self, other):
-        return self.priority < other.priority
+        return (self.priority, self.queued_at or 0) < (other.priority, other.queued_at or 0)
 
     def process(self):
         if self.mode is None:
             return
         handler = {
-            'gallery': lambda: rip(**self.__params),
-            'gallery_html': lambda: rip(**self.__params),
-            'favs': lambda: rip(**self.__params),
-            'favs_html': lambda: rip(**self.__params),
-            'scraps': lambda: rip(**self.__params),
-            'collection': lambda: rip(**self.__params),
-            'collection_html': lambda: rip(**self.__params),
-            'album': lambda: rip(**self.__params),
-            'album_html': lambda: rip(**self.__params),
-            'favs_featured': lambda: rip(**self.__params),
-            'gallery_featured': lambda: rip(**self.__params),
-            'search': lambda: rip(**self.__params),
-            'search_html': lambda: rip(**self.__params),
-            'tag': lambda: rip(**self.__params),
-            'tag_html': lambda: rip(**self.__params),
-            'query': lambda: rip(**self.__params),
+            'gallery': lambda: rip(**self.rip_params),
+            'gallery_html': lambda: rip(**self.rip_params),
+            'favs': lambda: rip(**self.rip_params),
+            'favs_html': lambda: rip(**self.rip_params),
+            'scraps': lambda: rip(**self.rip_params),
+            'collection': lambda: rip(**self.rip_params),
+            'collection_html': lambda: rip(**self.rip_params),
+            'album': lambda: rip(**self.rip_params),
+            'album_html': lambda: rip(**self.rip_params),
+            'favs_featured': lambda: rip(**self.rip_params),
+            'gallery_featured': lambda: rip(**self.rip_params),
+            'search': lambda: rip(**self.rip_params),
+            'search_html': lambda: rip(**self.rip_params),
+            'tag': lambda: rip(**self.rip_params),
+            'tag_html': lambda: rip(**self.rip_params),
+            'query': lambda: rip(**self.rip_params),
             'art': lambda: update_bookmarks('art', self.deviant, self.mval),
         }.get(self.mode)
         if handler is None:
@@ -0,0 +1,98 @@
+import json
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class QueueJournal():
+
+    def __init__(self, storage, slug, journal_dir, segment_size=10000, compact_size=50000):
+        self.__storage = storage
+        self.__slug = slug
+        self.__dir = Path(journal_dir)
+        self.__segment_size = int(segment_size)
+        self.__compact_size = int(compact_size)
+        self.__segment_num = 0
+        self.__segment_count = 0
+        self.__segment_file = None
+        self.__pending = 0
+
+        if not self.__dir.exists():
+            self.__dir.mkdir(parents=True)
+
+    @property
+    def pending(self):
+        return self.__pending
+
+    @property
+    def needs_compact(self):
+        return self.__pending >= self.__compact_size
+
+    def __segments(self):
+        return sorted(self.__dir.glob('segment-*.jsonl'))
+
+    def __segment_path(self, num):
+        return self.__dir.joinpath(f"segment-{num:08d}.jsonl")
+
+    def __open_segment(self):
+        self.__segment_num += 1
+        self.__segment_count = 0
+        self.__segment_file = self.__segment_path(
+            self.__segment_num).open('a')
+
+    def __close_segment(self):
+        if self.__segment_file is not None:
+            self.__segment_file.close()
+            self.__segment_file = None
+
+    def __append(self, op, params):
+        if self.__segment_file is None or self.__segment_count >= self.__segment_size:
+            self.__close_segment()
+            self.__open_segment()
+        print(json.dumps({'op': op, 'item': params}),
+              file=self.__segment_file, flush=True)
+        self.__segment_count += 1
+        self.__pending += 1
+
+    def add(self, params):
+        self.__append('add', params)
+
+    def remove(self, params):
+        self.__append('remove', params)
+
+    def replay(self):
+        applied = 0
+        for segment in self.__segments():
+            self.__segment_num = max(
+                self.__segment_num, int(segment.stem.split('-')[1]))
+            with segment.open('r') as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(
+                            f"Skipping truncated journal record in {segment.name}")
+                        continue
+                    if record['op'] == 'add':
+                        self.__storage.update(self.__slug, record['item'])
+                    elif record['op'] == 'remove':
+                        self.__storage.remove(self.__slug, record['item'])
+                    applied += 1
+        logger.info(f"Replayed {applied} queue journal records")
+        self.__pending = applied
+        return applied
+
+    def compact(self):
+        self.__close_segment()
+        self.__storage.flush(self.__slug)
+        removed = 0
+        for segment in self.__segments():
+            segment.unlink()
+            removed += 1
+        logger.log(
+            level=15, msg=f"Compacted {self.__pending} journal records from {removed} segments")
+        self.__pending = 0
+
+    def close(self):
+        self.__close_segment()
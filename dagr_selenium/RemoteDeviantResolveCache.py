@@ -0,0 +1,135 @@
+import logging
+from os import environ
+from time import time
+
+import requests
+
+from .DeviantResolveCache import DeviantResolveCache
+
+logger = logging.getLogger(__name__)
+
+remote_caches = dict()
+
+
+def create_resolve_cache(storage, url=None):
+    url = url or environ.get('QUEUEMAN_RESOLVE_CACHE_URL', None)
+    if url:
+        url = url.rstrip('/')
+        if not url in remote_caches:
+            remote_caches[url] = RemoteDeviantResolveCache(url)
+        return remote_caches[url]
+    return DeviantResolveCache(storage)
+
+
+class RemoteDeviantResolveCache():
+
+    def __init__(self, url, session=None, sync_interval=None, timeout=60):
+        self.__url = url.rstrip('/')
+        self.__session = session or requests.Session()
+        self.__sync_interval = float(sync_interval or environ.get(
+            'RESOLVE_CACHE_SYNC_INTERVAL', 5))
+        self.__timeout = timeout
+        self.__contents = dict()
+        self.__seq = -1
+        self.__epoch = None
+        self.__synced = 0
+        self.__hits = 0
+        self.__misses = 0
+
+        self.sync()
+
+    @property
+    def hits(self):
+        return self.__hits
+
+    @property
+    def misses(self):
+        return self.__misses
+
+    def __request(self, method, path, **kwargs):
+        resp = self.__session.request(
+            method, f"{self.__url}/{path}", timeout=self.__timeout, **kwargs)
+        resp.raise_for_status()
+        return resp.json()
+
+    def sync(self):
+        try:
+            params = {'since': self.__seq}
+            if self.__epoch is not None:
+                params['epoch'] = self.__epoch
+            result = self.__request('GET', 'changes', params=params)
+        except requests.exceptions.RequestException:
+            logger.warning('Unable to sync remote resolve cache', exc_info=True)
+            return
+        if result['reset']:
+            self.__contents.clear()
+        for change in result['changes']:
+            if change['op'] == 'add':
+                self.__contents[change['deviant']] = change['entry']
+            else:
+                self.__contents.pop(change['deviant'], None)
+        self.__seq = result['seq']
+        self.__epoch = result.get('epoch')
+        self.__synced = time()
+        logger.log(
+            level=15, msg=f"Synced {len(result['changes'])} remote resolve cache changes")
+
+    def __maybe_sync(self):
+        if time() - self.__synced > self.__sync_interval:
+            self.sync()
+
+    def query_raw(self, deviant):
+        self.__maybe_sync()
+        entry = self.__contents.get(deviant.lower(), None)
+        if entry is None or time() >= entry['expiry']:
+            try:
+                entry = self.__request(
+                    'GET', 'query', json={'deviant': deviant})['result']
+            except requests.exceptions.RequestException:
+                logger.warning('Unable to query remote resolve cache', exc_info=True)
+                return None
+            if entry is not None:
+                self.__contents[deviant.lower()] = entry
+        return entry
+
+    def query(self, deviant):
+        entry = self.query_raw(deviant)
+        if entry and time() < entry['expiry']:
+            logger.info('Resolve cache hit')
+            self.__hits += 1
+            return DeviantResolveCache.resolve_entry(entry)
+        logger.info('Resolve cache miss')
+        self.__misses += 1
+        return None
+
+    def __add(self, item):
+        try:
+            entries = self.__request('POST', 'items', json=[item])
+        except requests.exceptions.RequestException:
+            logger.warning(f"Unable to add {item} to remote resolve cache", exc_info=True)
+            return None
+        for entry in entries:
+            self.__contents[entry['resolved'].lower()] = entry
+        return entries[0] if entries else None
+
+    def add(self, deviant, deactivated=False):
+        return self.__add({'deviant': deviant, 'deactivated': deactivated})
+
+    def add_negative(self, deviant, reason='unresolvable'):
+        return self.__add({'deviant': deviant, 'negative': reason})
+
+    def purge(self, deviant):
+        self.__request('DELETE', 'items', json=[deviant])
+        self.__contents.pop(deviant.lower(), None)
+
+    def purge_negative(self, deviants=None):
+        result = self.__request('DELETE', 'items', params={
+                                'negative': 'true'}, json=deviants)
+        self.sync()
+        return result.get('purged', 0)
+
+    async def prune(self):
+        pass
+
+    async def flush(self):
+        self.sync()
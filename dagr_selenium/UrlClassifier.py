@@ -0,0 +1,69 @@
+import logging
+import re
+
+from dagr_revamped.utils import artist_from_url
+
+logger = logging.getLogger(__name__)
+
+
+class UrlClassifier():
+    mval_slices = {'tag': 1, 'gallery': False, 'favs': False, 'gallery_featured': False,
+                   'favs_featured': False, 'art': 1, 'album': 2, 'collection': 2}
+
+    def __init__(self, regexes, priorities, max_priority, nd_modes=None):
+        self.__nd_modes = set(nd_modes or [])
+        self.__modes = sorted((m for m in regexes.keys() if priorities[m] < max_priority),
+                              key=lambda m: priorities[m])
+        self.__patterns = [re.compile(regexes[m]) for m in self.__modes]
+        self.__combined = None
+        self.__group_modes = dict()
+        if not any(re.search(r'\\\d', regexes[m]) for m in self.__modes):
+            try:
+                self.__combined = re.compile('|'.join(
+                    f"(?P<_m{i}>{regexes[m]})" for i, m in enumerate(self.__modes)))
+                self.__group_modes = {
+                    f"_m{i}": m for i, m in enumerate(self.__modes)}
+            except re.error:
+                logger.warning(
+                    'Unable to combine url regexes, falling back to ordered matching')
+        logger.log(
+            level=15, msg=f"Url classifier modes: {self.__modes}, combined: {self.__combined is not None}")
+
+    def detect_mode(self, url):
+        if self.__combined is not None:
+            match = self.__combined.match(url)
+            return None if match is None else self.__group_modes[match.lastgroup]
+        for mode, pattern in zip(self.__modes, self.__patterns):
+            if pattern.match(url):
+                return mode
+        return None
+
+    @staticmethod
+    def detect_mval(mode, url):
+        slice_count = UrlClassifier.mval_slices.get(mode)
+        if slice_count is False:
+            return None
+        if slice_count is None:
+            raise NotImplementedError(f"Mode {mode} is not implemented")
+        parts = [p for p in url.split('/') if p and p != '.']
+        return '/'.join(parts[len(parts) - slice_count:])
+
+    def classify(self, url):
+        mode = self.detect_mode(url)
+        if mode is None:
+            raise NotImplementedError(f"Unable to get mode for url {url}")
+        deviant = None
+        if not mode in self.__nd_modes:
+            _artist_url_p, deviant, _shortname = artist_from_url(url, mode)
+        return mode, deviant, UrlClassifier.detect_mval(mode, url)
+
+    def classify_many(self, urls):
+        results = []
+        for url in urls:
+            try:
+                mode, deviant, mval = self.classify(url)
+                results.append(
+                    {'url': url, 'mode': mode, 'deviant': deviant, 'mval': mval})
+            except NotImplementedError:
+                results.append({'url': url, 'mode': None})
+        return results
@@ -11,6 +11,26 @@ from dagr_selenium.BulkCache import BulkCache
 from dagr_selenium.utils import get_urls
 
 
+def admission_limited(session, admission_url):
+    state = session.get(admission_url).json()
+    return any(mode.get('high') is not None for mode in state.values())
+
+
+async def wait_for_workers(session, urls, logger):
+    try:
+        if admission_limited(session, urls['admission']):
+            return
+    except:
+        logger.exception('Unable to get admission state')
+    waiting = 0
+    while waiting <= 1:
+        try:
+            waiting = session.get(urls['waiting']).json()['waiting']
+        except:
+            logger.exception('Unable to get waiting count')
+        await asyncio.sleep(30)
+
+
 async def __main__():
     logger = logging.getLogger(__name__)
     manager = DAGRManager()
@@ -24,31 +44,31 @@ async def __main__():
     manager.init_logging(level_mapped)
     urls = get_urls(config)
     enqueue_url = urls['enqueue']
-    waiting_url = urls['waiting']
     bulk_cache = BulkCache(manager.get_cache())
     with TCPKeepAliveSession() as session:
         async for item in bulk_cache.get_items():
-            waiting = 0
-            while waiting <= 1:
-                try:
-                    waiting = session.get(waiting_url).json()['waiting']
-                except:
-                    logger.exception('Unable to get waiting count')
-                await asyncio.sleep(30)
+            await wait_for_workers(session, urls, logger)
             logger.info(
                 f"{item.get('mode')} {item.get('deviant')} {item.get('mval')}")
             succeded = False
-            resp = None
             while succeded is False:
                 try:
                     http_post_raw(session, enqueue_url, json=[item])
                     succeded = True
                 except HTTPError as ex:
+                    if ex.response.status_code == 429:
+                        retry_after = int(
+                            ex.response.headers.get('Retry-After', 30))
+                        logger.info(
+                            f"Queue manager is throttling, retrying in {retry_after} seconds")
+                        await asyncio.sleep(retry_after)
+                        continue
                     if ex.response.status_code == 400:
                         succeded = True
                     logger.exception('Failed to enqueue item')
                 except ConnectionError:
                     logger.exception('Connection error')
+                    await asyncio.sleep(30)
     logger.info('Finished')
 
 if __name__ == '__main__':
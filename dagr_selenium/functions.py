@@ -14,6 +14,7 @@ from dagr_revamped.exceptions import DagrCacheLockException, DagrException
 from dagr_revamped.TCPKeepAliveSession import TCPKeepAliveSession
 from dagr_revamped.utils import (artist_from_url, get_html_name, get_remote_io,
                                  http_post_raw, load_json, save_json)
+from requests.exceptions import HTTPError
 from selenium.common.exceptions import (InvalidSessionIdException,
                                         NoSuchElementException,
                                         StaleElementReferenceException)
@@ -22,7 +23,7 @@ from selenium.common.exceptions import \
 from selenium.common.exceptions import WebDriverException
 from urllib3.util.retry import Retry
 
-from .DeviantResolveCache import DeviantResolveCache
+from .RemoteDeviantResolveCache import create_resolve_cache
 
 click_sleep_time = 0.300
 monitor_sleep = environ.get('MONITOR_SLEEP', 300)
@@ -47,10 +48,35 @@ queueman_enqueue_url = environ.get('QUEUEMAN_ENQUEUE_URL', None) or config.get(
     'dagr.plugins.selenium', 'queueman_enqueue_url', key_errors=False) or 'http://127.0.0.1:3005/items'
 
 
+queueman_ack_url = environ.get('QUEUEMAN_ACK_URL', None) or config.get(
+    'dagr.plugins.selenium', 'queueman_ack_url', key_errors=False) or f"{queueman_fetch_url}/ack"
+
+
+queueman_nack_url = environ.get('QUEUEMAN_NACK_URL', None) or config.get(
+    'dagr.plugins.selenium', 'queueman_nack_url', key_errors=False) or f"{queueman_fetch_url}/nack"
+
+
+queueman_extend_url = environ.get('QUEUEMAN_EXTEND_URL', None) or config.get(
+    'dagr.plugins.selenium', 'queueman_extend_url', key_errors=False) or f"{queueman_fetch_url}/extend"
+
+
+queueman_push_url = environ.get('QUEUEMAN_PUSH_URL', None) or config.get(
+    'dagr.plugins.selenium', 'queueman_push_url', key_errors=False)
+
+
+worker_lease_timeout = int(environ.get('WORKER_LEASE_TIMEOUT', 900))
+
+worker_modes = environ.get('WORKER_MODES', None)
+
+
 logger.info('Queman Urls:')
 logger.info(pformat({
     'queueman_fetch_url':  queueman_fetch_url,
-    'queueman_enqueue_url': queueman_enqueue_url
+    'queueman_enqueue_url': queueman_enqueue_url,
+    'queueman_ack_url': queueman_ack_url,
+    'queueman_nack_url': queueman_nack_url,
+    'queueman_extend_url': queueman_extend_url,
+    'queueman_push_url': queueman_push_url
 }))
 
 
@@ -201,7 +227,7 @@ def sort_watchlist(resort=False):
 def sort_pages(to_sort, resort=False, queued_only=True, flush=True, disable_resolve=None):
     sorted_pages = set()
     crawler_cache = manager.get_cache()
-    resolve_cache = DeviantResolveCache(crawler_cache)
+    resolve_cache = create_resolve_cache(crawler_cache)
     cache_slug = 'sorted'
     pending_slug = 'pending_gallery'
     history = crawler_cache.query(cache_slug)
@@ -484,7 +510,20 @@ def chunk(it, size):
     return iter(lambda: tuple(islice(it, size)), ())
 
 
-def queue_items(mode, deviants, priority=100, full_crawl=False, resolved=None):
+def post_queue_items(items):
+    while True:
+        try:
+            return http_post_raw(session, queueman_enqueue_url, json=items)
+        except HTTPError as ex:
+            if ex.response is None or ex.response.status_code != 429:
+                raise
+            retry_after = int(ex.response.headers.get('Retry-After', 30))
+            logger.info(
+                f"Queue manager is throttling, retrying in {retry_after} seconds")
+            sleep(retry_after)
+
+
+def queue_items(mode, deviants, priority=100, full_crawl=False, resolved=None, not_before=None):
     cache = manager.get_cache()
     cache_slug = f"pending_{mode}"
     if not isinstance(deviants, set):
@@ -494,10 +533,13 @@ def queue_items(mode, deviants, priority=100, full_crawl=False, resolved=None):
     for deviantschunk in chunk(deviants, 5):
         items = [{'mode': mode, 'deviant': d, 'priority': priority,
                   'full_crawl': full_crawl, 'resolved': resolved} for d in deviantschunk]
+        if not not_before is None:
+            for i in items:
+                i['not_before'] = not_before
         logger.info(
             f"Sending {mode} {deviantschunk} to queue manager")
         try:
-            http_post_raw(session, queueman_enqueue_url, json=items)
+            post_queue_items(items)
         except:
             logger.exception('Error while enquing items')
             try:
@@ -505,7 +547,6 @@ def queue_items(mode, deviants, priority=100, full_crawl=False, resolved=None):
                 cache.flush(cache_slug)
             except:
                 logger.exception('Error while caching pending items')
-            sleep(900)
         else:
             logger.info(
                 f"Pruning cache; removing {deviantschunk} from {cache_slug}")
@@ -555,14 +596,14 @@ def flush_errors_to_queue():
 
 def resolve_deviant(deviant, resolve_cache=None):
     if resolve_cache is None:
-        resolve_cache = DeviantResolveCache(manager.get_cache())
+        resolve_cache = create_resolve_cache(manager.get_cache())
     logger.info(f"Attempting to resolve {deviant}")
     try:
         cached_result = resolve_cache.query(deviant)
         if cached_result:
             return cached_result
-    except DagrException:
-        logger.warning(f"Deviant {deviant} is listed as deactivated")
+    except DagrException as ex:
+        logger.warning(f"Deviant {deviant} is listed as unavailable: {ex}")
         raise
     try:
         deviant, _group = manager.get_dagr().resolve_deviant(deviant)
@@ -575,6 +616,7 @@ def resolve_deviant(deviant, resolve_cache=None):
             logger.log(level=15, msg=f"Added {deviant} to deactivated list")
             raise
         logger.warning(f"Unable to resolve deviant {deviant}")
+        resolve_cache.add_negative(deviant)
         raise
 
 
@@ -1,5 +1,5 @@
 import asyncio
-from dagr_selenium.DeviantResolveCache import DeviantResolveCache
+from dagr_selenium.RemoteDeviantResolveCache import create_resolve_cache
 import logging
 from os import environ, truncate
 
@@ -46,15 +46,21 @@ async def update_cache(request, slug):
 
 
 async def purge_resolve_cache_items(request):
-    deviants = await request.json()
+    deviants = await request.json() if request.can_read_body else None
     crawler_cache = request.app['crawler_cache']
-    resolve_cache = DeviantResolveCache(crawler_cache)
+    resolve_cache = create_resolve_cache(crawler_cache)
 
-    if not isinstance(deviants, list):
+    if not deviants is None and not isinstance(deviants, list):
         deviants = [deviants]
 
-    for d in deviants:
-        resolve_cache.purge(d)
+    if request.query.get('negative', '').lower() in ['1', 'true', 'yes']:
+        purged = resolve_cache.purge_negative(deviants)
+        logging.info('Purged %s negative entries', purged)
+    else:
+        for d in deviants or []:
+            resolve_cache.purge(d)
+
+    await resolve_cache.flush()
 
     return json_response('ok')
 
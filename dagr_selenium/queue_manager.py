@@ -1,27 +1,41 @@
 import asyncio
 import logging
-import re
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from json import dumps, loads
 from json.decoder import JSONDecodeError
 from os import environ
-from pathlib import Path, PurePosixPath
+from pathlib import Path
 from pprint import pformat
+from time import time
 
-from aiohttp import web
+from aiohttp import WSMsgType, web
 from aiohttp.web_response import json_response
-from aiojobs.aiohttp import setup, spawn
+from aiojobs.aiohttp import setup
 from dagr_revamped.DAGRManager import DAGRManager
 from dagr_revamped.lib import DagrException
-from dagr_revamped.utils import artist_from_url, convert_queue
+from dagr_revamped.utils import convert_queue
 from dotenv import load_dotenv
 from pybreaker import CircuitBreakerError
 
+from dagr_selenium.AdmissionControl import AdmissionControl
 from dagr_selenium.BulkCache import BulkCache
+from dagr_selenium.DeadLetterQueue import DeadLetterQueue
 from dagr_selenium.DeviantResolveCache import DeviantResolveCache
+from dagr_selenium.DeviantResolver import DeviantResolver
+from dagr_selenium.IndexedQueue import IndexedQueue
 from dagr_selenium.JSONHTTPErrors import (JSONHTTPBadRequest,
-                                          JSONHTTPInternalServerError)
+                                          JSONHTTPInternalServerError,
+                                          JSONHTTPNotFound,
+                                          JSONHTTPTooManyRequests)
+from dagr_selenium.JobStats import JobStats
+from dagr_selenium.LeaseManager import LeaseManager
+from dagr_selenium.Metrics import Metrics
+from dagr_selenium.QueueCacheWriter import QueueCacheWriter
 from dagr_selenium.QueueItem import QueueItem
+from dagr_selenium.QueueJournal import QueueJournal
 from dagr_selenium.SleepMgr import SleepMgr
-from dagr_selenium.utils import resolve_deviant
+from dagr_selenium.UrlClassifier import UrlClassifier
+from dagr_selenium.utils import chunk
 
 logger = logging.getLogger(__name__)
 
@@ -36,92 +50,85 @@ class WaitingCount():
     def __exit__(self, type, value, tb):
         self.__value -= 1
 
+    def add(self, count):
+        self.__value += count
+
     @property
     def value(self):
         return self.__value
 
 
-async def add_to_queue(queue, mode, deviant=None, mval=None, priority=100, full_crawl=False, resolved=False, disable_filter=False, verify_exists=None, verify_best=None, no_crawl=None, crawl_offset=None, load_more=None, dump_html=None):
-    item = QueueItem(mode=mode, deviant=deviant, mval=mval, priority=priority,          full_crawl=full_crawl, resolved=resolved, disable_filter=disable_filter,
-                     verify_exists=verify_exists, verify_best=verify_best, no_crawl=no_crawl, crawl_offset=crawl_offset, load_more=load_more, dump_html=dump_html)
-    params = item.params
-    logger.info(f"Adding {params} to queue")
-    await queue.put(item)
+async def add_to_queue(app, mode, deviant=None, mval=None, priority=100, full_crawl=False, resolved=False, disable_filter=False, verify_exists=None, verify_best=None, no_crawl=None, crawl_offset=None, load_more=None, dump_html=None, not_before=None, delay=None, queued_at=None):
+    if delay is not None:
+        not_before = time() + float(delay)
+    item = QueueItem(queued_at=time() if queued_at is None else queued_at, mode=mode, deviant=deviant, mval=mval, priority=priority,          full_crawl=full_crawl, resolved=resolved, disable_filter=disable_filter,
+                     verify_exists=verify_exists, verify_best=verify_best, no_crawl=no_crawl, crawl_offset=crawl_offset, load_more=load_more, dump_html=dump_html, not_before=not_before)
+    logger.info(f"Adding {item.params} to queue")
+    app['metrics'].enqueued.inc(item.mode)
+    queued, replaced = await app['queue'].put(item)
+    persist_queued_item(app, item, queued, replaced)
+    app['admission'].update(item.mode)
     logger.info('Finished adding item')
-    return params
+    return queued.params
+
+
+def persist_queued_item(app, item, queued, replaced):
+    queue_writer = app['queue_writer']
+    if replaced is not None:
+        logger.info(f"Merged {item.params} into queued item {replaced.params}")
+        queue_writer.remove(replaced.raw_params)
+    if queued is item or replaced is not None:
+        queue_writer.add(queued.raw_params)
+
+
+def check_admission(app, modes):
+    admission = app['admission']
+    if not admission.admit(modes):
+        logger.info(f"Rejecting items for throttled modes {sorted(modes)}")
+        raise JSONHTTPTooManyRequests(
+            headers={'Retry-After': str(admission.retry_after)}, reason='not ok: queue full')
+
+
+def request_item_key(params):
+    return QueueItem(mode=params.get('mode'), deviant=params.get('deviant'), mval=params.get('mval')).key
 
 
 def detect_mode(app, url):
-    regex_max_priority = app['regex_max_priority']
-    regexes = app['regexes']
-    regex_priorities = app['regex_priorities']
-    logger.log(15, 'Got url: %s', url)
-    for p in range(regex_max_priority):
-        logger.log(level=15, msg=f"Trying regex priority {p}")
-        for mode in regexes:
-            if regex_priorities[mode] == p:
-                logger.log(level=15, msg=f"Trying regex for {mode}")
-                if regexes[mode].match(url):
-                    logger.log(15, "Mode is '%s'", mode)
-                    return mode
-    return None
+    return app['url_classifier'].detect_mode(url)
 
 
 def detect_mval(mode, url):
-    parts = PurePosixPath(url).parts
-    logger.log(15, "Mode: %s, Url: '%s' Parts: %s", mode, url, list(parts))
-    slice_count = {'tag': 1, 'gallery': False, 'favs': False, 'gallery_featured': False,
-                   'favs_featured': False, 'art': 1, 'album': 2, 'collection': 2}.get(mode)
-    if slice_count is False:
-        logger.log(15, 'No slice')
-        return None
-    if slice_count is None:
-        raise NotImplementedError(f"Mode {mode} is not implemented")
-    slice_val = len(parts) - slice_count
-    sliced = [*parts[len(parts) - slice_count:]]
-    result = str(PurePosixPath(*sliced))
-    logger.log(15, 'Slice val: %s, Sliced: %s, result: %s', slice_val, sliced, result)
-    return result
+    return UrlClassifier.detect_mval(mode, url)
 
 
 async def add_url(request):
     post_contents = await request.post()
 
     app = request.app
-    manager = app['manager']
-    resolve_cache = app['resolve_cache']
-    queue = app['queue']
 
     nd_modes = app['nd_modes']
 
     url = post_contents.get('url')
     priority = post_contents.get('priority', 100)
     full_crawl = post_contents.get('full_crawl', False)
-    deviant = None
 
     if url is None:
         return JSONHTTPBadRequest(reason='not ok: url missing')
 
     try:
-        mode = detect_mode(app, url)
-        if mode is None:
-            raise NotImplementedError(f"Unable to get mode for url {url}")
+        mode, deviant, mval = app['url_classifier'].classify(url)
+        check_admission(app, [mode])
 
         if mode not in nd_modes:
-            _artist_url_p, deviant, _shortname = artist_from_url(url, mode)
             if deviant is None:
                 return JSONHTTPBadRequest(reason='not ok: deviant missing')
             try:
-                deviant = await resolve_deviant(manager, deviant, resolve_cache)
+                deviant = await app['resolver'].resolve(deviant)
             except DagrException:
                 raise JSONHTTPBadRequest(
                     reason='not ok: unable to resolve deviant')
 
-        mval = detect_mval(mode, url)
-        params = await add_to_queue(queue=queue, mode=mode, deviant=deviant, mval=mval, priority=priority, full_crawl=full_crawl, resolved=True)
-
-        await spawn(request, update_queue_cache(app, params))
-        await spawn(request, flush_queue_cache(app))
+        await add_to_queue(app, mode=mode, deviant=deviant, mval=mval, priority=priority, full_crawl=full_crawl, resolved=True)
 
         logger.info('Finished add_url request')
         return json_response('ok')
@@ -130,48 +137,34 @@ async def add_url(request):
         return JSONHTTPBadRequest(reason='not ok: unable to handle url')
 
 
-async def update_queue_cache(app, params):
-    queue_lock = app['queue_lock']
-    crawler_cache = app['crawler_cache']
-    queue_slug = app['queue_slug']
-    async with queue_lock:
-        try:
-            crawler_cache.update(queue_slug, params)
-        except:
-            logger.exception('Error while updating queue cache')
+async def classify_urls(request):
+    urls = await request.json()
+
+    if not isinstance(urls, list):
+        raise JSONHTTPBadRequest(reason='not ok: expected a list of urls')
+
+    return json_response(request.app['url_classifier'].classify_many(urls))
 
 
 async def flush_queue_cache(app):
     queue_lock = app['queue_lock']
-    crawler_cache = app['crawler_cache']
-    queue_slug = app['queue_slug']
+    queue_journal = app['queue_journal']
 
     async with queue_lock:
-        try:
-            crawler_cache.flush(queue_slug)
-        except:
-            logger.exception('Error while flushing queue cache')
+        if queue_journal.pending > 0:
+            compact_queue_journal(queue_journal, force=True)
 
 
-async def remove_queue_cache_item(app, params):
-    queue_lock = app['queue_lock']
-    crawler_cache = app['crawler_cache']
-    queue_slug = app['queue_slug']
-
-    logger.info('Waiting for queue lock')
-    async with queue_lock:
-        logger.info(f"Removing {params} from queue cache")
+def compact_queue_journal(queue_journal, force=False):
+    if force or queue_journal.needs_compact:
         try:
-            crawler_cache.remove(queue_slug, params)
+            queue_journal.compact()
         except:
-            logger.exception('Error while removing item from cache')
+            logger.exception('Error while flushing queue cache')
 
 
 async def add_items(request):
     app = request.app
-    manager = app['manager']
-    resolve_cache = app['resolve_cache']
-    queue = app['queue']
     nd_modes = app['nd_modes']
 
     try:
@@ -181,69 +174,499 @@ async def add_items(request):
         raise JSONHTTPBadRequest(
             reason='not ok: JSONDecodeError')
 
+    check_admission(app, set(item['mode'] for item in items_list))
+
+    unresolved = [item for item in items_list if item['mode'] not in nd_modes and (
+        (not 'resolved' in item) or (not item['resolved']))]
+
+    if unresolved:
+        resolved = await app['resolver'].resolve_many(
+            [item['deviant'] for item in unresolved])
+        for item in unresolved:
+            result = resolved[item['deviant'].lower()]
+            if isinstance(result, DagrException):
+                raise JSONHTTPBadRequest(
+                    reason='not ok: unable to resolve deviant')
+            item['deviant'] = result
+            item['resolved'] = True
+
     for item in items_list:
-        if item['mode'] not in nd_modes:
-            if ((not 'resolved' in item) or (not item['resolved'])):
-                try:
-                    item['deviant'] = await resolve_deviant(
-                        manager, item['deviant'], resolve_cache)
-                except DagrException:
-                    raise JSONHTTPBadRequest(
-                        reason='not ok: unable to resolve deviant')
-
-                item['resolved'] = True
-
-            else:
-                logger.info('Deviant already resolved')
-
-        params = await add_to_queue(queue=queue, **item)
-        await spawn(request, update_queue_cache(app, params))
+        await add_to_queue(app, **item)
         await asyncio.sleep(0)
 
-    await spawn(request, flush_queue_cache(app))
-
     logger.info('Finished add_items request')
     return json_response('ok')
 
 
+def get_lease_timeout(request):
+    if not 'lease' in request.query:
+        return None
+    try:
+        return max(int(request.query['lease']), 1)
+    except ValueError:
+        return request.app['LEASE_TIMEOUT']
+
+
+def get_dequeue_exclude(app, lease_timeout):
+    if lease_timeout is None or not app['DISPATCH_EXCLUSIVE']:
+        return None
+    return app['leases'].busy
+
+
+def release_lease(app, lease_id):
+    item = app['leases'].release(lease_id)
+    if item is not None and app['DISPATCH_EXCLUSIVE']:
+        app['queue'].notify_all()
+    return item
+
+
+def get_dequeue_modes(request):
+    modes = None
+    if request.query.get('modes'):
+        modes = [m.strip().lower()
+                 for m in request.query['modes'].split(',') if m.strip()]
+    if request.query.get('no_browser', '').lower() in ['1', 'true', 'yes']:
+        modes = [m for m in (modes or QueueItem.no_browser_modes)
+                 if m in QueueItem.no_browser_modes]
+    return modes
+
+
+def dispatch_items(app, items, lease_timeout):
+    metrics = app['metrics']
+    t_now = time()
+    for item in items:
+        metrics.dequeued.inc(item.mode)
+        if item.queued_at is not None:
+            metrics.item_age.observe(t_now - item.queued_at, item.mode)
+    for mode in set(i.mode for i in items):
+        app['admission'].update(mode)
+    if lease_timeout is None:
+        for item in items:
+            logger.info(f"Removing {item.raw_params} from queue cache")
+        if len(items) == 1:
+            app['queue_writer'].remove(items[0].raw_params)
+        else:
+            app['queue_writer'].remove_many([i.raw_params for i in items])
+        return [i.params for i in items]
+    leases = app['leases']
+    results = []
+    for item in items:
+        lease_id, expiry = leases.grant(item, lease_timeout)
+        results.append(
+            {'lease': lease_id, 'expiry': expiry, 'item': item.params})
+    return results
+
+
 async def get_item(request):
+    if 'count' in request.query:
+        return await get_items(request)
+
     app = request.app
     queue = app['queue']
     waiting_count = app['waiting_count']
     dequeue_timeout = app['DEQUEUE_TIMEOUT']
+    lease_timeout = get_lease_timeout(request)
+    modes = get_dequeue_modes(request)
     with waiting_count:
         try:
-            item = await asyncio.wait_for(queue.get(), dequeue_timeout)
-            queue.task_done()
-            params = item.params
-            logger.info(f"Dequed item {params}")
-            await spawn(request, remove_queue_cache_item(app, item.raw_params))
+            t_start = time()
+            item = await asyncio.wait_for(queue.get(modes, get_dequeue_exclude(app, lease_timeout)), dequeue_timeout)
+            app['metrics'].dequeue_wait.observe(time() - t_start)
+            logger.info(f"Dequed item {item.params}")
+            result, = dispatch_items(app, [item], lease_timeout)
             logger.info('Finished get_item request')
-            return json_response(params)
+            if lease_timeout is None:
+                return web.Response(text=item.json, content_type='application/json')
+            return json_response(result)
         except asyncio.TimeoutError:
             logger.log(level=15, msg='Timout waiting to dequeue work item')
-            return json_response({'mode': None})
+            if lease_timeout is None:
+                return json_response({'mode': None})
+            return json_response({'lease': None, 'expiry': None, 'item': {'mode': None}})
 
 
-async def resolve(request):
+async def get_items(request):
+    app = request.app
+    queue = app['queue']
+    waiting_count = app['waiting_count']
+    dequeue_timeout = app['DEQUEUE_TIMEOUT']
+
+    try:
+        count = int(request.query['count'])
+    except ValueError:
+        raise JSONHTTPBadRequest(reason='not ok: invalid count')
+    count = max(1, min(count, app['DEQUEUE_MAX_BATCH']))
+    modes = get_dequeue_modes(request)
+    lease_timeout = get_lease_timeout(request)
+    exclude = get_dequeue_exclude(app, lease_timeout)
+
+    with waiting_count:
+        try:
+            t_start = time()
+            first = await asyncio.wait_for(queue.get(modes, exclude), dequeue_timeout)
+            app['metrics'].dequeue_wait.observe(time() - t_start)
+        except asyncio.TimeoutError:
+            logger.log(level=15, msg='Timout waiting to dequeue work items')
+            return json_response([])
+    if exclude is not None and first.exclusive_key is not None:
+        exclude = set([*exclude, first.exclusive_key])
+    items = [first, *queue.get_many_nowait(count - 1, modes, exclude)]
+    logger.info(f"Dequed {len(items)} items")
+    results = dispatch_items(app, items, lease_timeout)
+    logger.info('Finished get_items request')
+    return json_response(results)
+
+
+async def push_items(request):
+    app = request.app
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    consumer = {'credit': 0, 'modes': None, 'lease': app['LEASE_TIMEOUT'],
+                'ready': asyncio.Event(), 'sender': None}
+    app['websockets'].add(ws)
+    logger.info('Push consumer connected')
+    try:
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            try:
+                params = loads(msg.data)
+                update_consumer(app, ws, consumer, params)
+            except (JSONDecodeError, ValueError, TypeError, AttributeError):
+                await ws.send_json({'type': 'error', 'reason': 'not ok: invalid message'})
+    finally:
+        app['websockets'].discard(ws)
+        if consumer['sender'] is not None:
+            consumer['sender'].cancel()
+        app['waiting_count'].add(-consumer['credit'])
+        logger.info('Push consumer disconnected')
+    return ws
+
+
+def update_consumer(app, ws, consumer, params):
+    msg_type = params.get('type')
+    credit = max(int(params.get('credit', 0)), 0)
+    if msg_type == 'subscribe':
+        modes = consumer['modes']
+        if params.get('modes'):
+            modes = [m.strip().lower() for m in params['modes']]
+        if params.get('lease'):
+            consumer['lease'] = max(int(params['lease']), 1)
+        sender = consumer['sender']
+        if sender is None or sender.done() or modes != consumer['modes']:
+            consumer['modes'] = modes
+            if sender is not None:
+                sender.cancel()
+            consumer['sender'] = asyncio.create_task(
+                push_to_consumer(app, ws, consumer))
+        credit -= consumer['credit']
+    elif msg_type != 'credit':
+        raise ValueError(f"Unknown message type {msg_type}")
+    elif consumer['sender'] is None:
+        raise ValueError('Credit received before subscribe')
+    consumer['credit'] += credit
+    app['waiting_count'].add(credit)
+    if consumer['credit'] > 0:
+        consumer['ready'].set()
+    else:
+        consumer['ready'].clear()
+
+
+async def push_to_consumer(app, ws, consumer):
+    queue = app['queue']
+    while not ws.closed:
+        await consumer['ready'].wait()
+        item = await queue.get(consumer['modes'], get_dequeue_exclude(app, consumer['lease']))
+        result, = dispatch_items(app, [item], consumer['lease'])
+        consumer['credit'] -= 1
+        app['waiting_count'].add(-1)
+        if consumer['credit'] == 0:
+            consumer['ready'].clear()
+        try:
+            await ws.send_json({'type': 'item', **result})
+            logger.info(f"Pushed item {item.params}")
+        except:
+            logger.warning(
+                f"Unable to push {item.params}, requeueing", exc_info=True)
+            release_lease(app, result['lease'])
+            requeue_cached_item(app, item)
+            return
+
+
+async def close_websockets(app):
+    for ws in set(app['websockets']):
+        await ws.close(code=1001, message=b'Server shutdown')
+
+
+def requeue_cached_item(app, item):
+    queue_writer = app['queue_writer']
+    queued, replaced = app['queue'].put_nowait(item)
+    if queued is not item:
+        for stale in [item, replaced]:
+            if stale is not None and stale.raw_params != queued.raw_params:
+                queue_writer.remove(stale.raw_params)
+        if replaced is not None:
+            queue_writer.add(queued.raw_params)
+    return queued
+
+
+async def get_lease_params(request):
+    params = await request.json()
+    lease_id = params.get('lease', None)
+    if lease_id is None:
+        raise JSONHTTPBadRequest(reason='not ok: lease missing')
+    return params, lease_id
+
+
+async def ack_item(request):
+    params, lease_id = await get_lease_params(request)
+    app = request.app
+    lease_age = app['leases'].age(lease_id)
+    item = release_lease(app, lease_id)
+    if item is None:
+        raise JSONHTTPNotFound(reason='not ok: unknown lease')
+    logger.info(f"Lease {lease_id} acked, removing {item.raw_params} from queue cache")
+    app['queue_writer'].remove(item.raw_params)
+    app['dead_letters'].clear(item.key)
+    stats = params.get('stats') or {}
+    try:
+        app['job_stats'].record(item, duration=stats.get('duration', lease_age),
+                                pages=stats.get('pages'), bytes=stats.get('bytes'))
+    except (AttributeError, TypeError, ValueError):
+        logger.warning(f"Ignoring invalid job stats {stats}")
+    return json_response('ok')
+
+
+async def nack_item(request):
+    params, lease_id = await get_lease_params(request)
+    app = request.app
+    item = release_lease(app, lease_id)
+    if item is None:
+        raise JSONHTTPNotFound(reason='not ok: unknown lease')
+    if 'error' in params:
+        logger.info(f"Lease {lease_id} failed: {params['error']}")
+        retry_item(app, item, params['error'])
+    else:
+        logger.info(f"Lease {lease_id} nacked, requeueing {item.params}")
+        requeue_cached_item(app, item)
+    return json_response('ok')
+
+
+def retry_item(app, item, error, cached=True):
+    queue_writer = app['queue_writer']
+    if cached:
+        queue_writer.remove(item.raw_params)
+    record = app['dead_letters'].record_failure(item, error)
+    if record['dead']:
+        logger.warning(
+            f"Moving {item.params} to dead letter queue after {record['attempts']} attempts")
+        return None
+    retry = item.replace(not_before=record['next_eligible'])
+    logger.info(
+        f"Retrying {item.params} after attempt {record['attempts']} in {record['next_eligible'] - time():.0f} seconds")
+    queued, replaced = app['queue'].put_nowait(retry)
+    persist_queued_item(app, retry, queued, replaced)
+    return queued
+
+
+async def dlq_items(request):
+    dead_only = request.query.get('all', None) is None
+    return json_response(request.app['dead_letters'].query(dead_only))
+
+
+async def dlq_report(request):
     params = await request.json()
+    item_params = params.get('item', None)
+    if item_params is None or item_params.get('mode') is None:
+        raise JSONHTTPBadRequest(reason='not ok: item missing')
+    queued = retry_item(request.app, QueueItem(
+        **item_params), params.get('error', None), cached=False)
+    return json_response({'dead': queued is None})
+
 
+async def dlq_replay(request):
     app = request.app
-    manager = app['manager']
+    keys = None
+    if request.can_read_body:
+        keys = [request_item_key(k) for k in await request.json()]
+    replayed = 0
+    for record in app['dead_letters'].pop_dead(keys):
+        item = QueueItem(**record['item'])
+        queued, replaced = app['queue'].put_nowait(item)
+        persist_queued_item(app, item, queued, replaced)
+        replayed += 1
+    logger.info(f"Replayed {replayed} dead letter items")
+    return json_response({'replayed': replayed})
+
+
+async def extend_item(request):
+    params, lease_id = await get_lease_params(request)
+    app = request.app
+    expiry = app['leases'].extend(lease_id, params.get('timeout', None))
+    if expiry is None:
+        raise JSONHTTPNotFound(reason='not ok: unknown lease')
+    return json_response({'lease': lease_id, 'expiry': expiry})
+
+
+async def reap_leases(app):
+    leases = app['leases']
+    while True:
+        expired = leases.pop_expired()
+        for item in expired:
+            logger.info(f"Requeueing {item.params} from expired lease")
+            retry_item(app, item, 'Lease expired')
+        if expired and app['DISPATCH_EXCLUSIVE']:
+            app['queue'].notify_all()
+        await asyncio.sleep(app['LEASE_REAP_INTERVAL'])
+
+
+async def refresh_resolve_cache(app):
     resolve_cache = app['resolve_cache']
+    resolver = app['resolver']
+    while True:
+        await asyncio.sleep(app['RESOLVE_REFRESH_INTERVAL'])
+        if resolver.inflight > 0:
+            continue
+        candidates = resolve_cache.refresh_candidates(
+            app['RESOLVE_REFRESH_AHEAD'], app['RESOLVE_REFRESH_BATCH'], app['RESOLVE_REFRESH_MIN_HITS'])
+        for deviant in candidates:
+            if resolver.inflight > 0:
+                break
+            try:
+                await resolver.refresh(deviant)
+            except DagrException:
+                logger.warning(f"Unable to refresh {deviant}, keeping cached entry")
+            except:
+                logger.exception(f"Error while refreshing {deviant}")
+        if candidates:
+            logger.info(f"Refreshed {len(candidates)} resolve cache entries")
+
+
+async def item_status(request):
+    params = await request.json()
+    key = request_item_key(params)
+    item = request.app['queue'].query(key)
+    return json_response({'queued': item is not None, 'item': None if item is None else item.params})
+
+
+async def get_item_params(request):
+    if request.can_read_body:
+        return await request.json()
+    return dict(request.query)
+
+
+async def upgrade_item(request):
+    return await patch_item(request, upgrade_only=True)
+
+
+async def patch_item(request, upgrade_only=False):
+    params = await get_item_params(request)
+    app = request.app
+
+    try:
+        priority = int(params['priority'])
+    except (KeyError, TypeError, ValueError):
+        raise JSONHTTPBadRequest(reason='not ok: priority missing')
+
+    key = request_item_key(params)
+    if upgrade_only:
+        updated, replaced = app['queue'].upgrade(key, priority)
+    else:
+        updated, replaced = app['queue'].reprioritize(key, priority)
+    if updated is None:
+        raise JSONHTTPNotFound(reason='not ok: item not queued')
+    if replaced is not None:
+        logger.info(
+            f"Changed priority of {replaced.params} to {updated.priority}")
+        app['queue_writer'].remove(replaced.raw_params)
+        app['queue_writer'].add(updated.raw_params)
+    return json_response(updated.params)
+
+
+async def delete_item(request):
+    params = await get_item_params(request)
+    app = request.app
+
+    item = app['queue'].remove(request_item_key(params))
+    if item is None:
+        raise JSONHTTPNotFound(reason='not ok: item not queued')
+    logger.info(f"Cancelled {item.params}")
+    app['queue_writer'].remove(item.raw_params)
+    app['admission'].update(item.mode)
+    return json_response(item.params)
+
+
+async def resolve(request):
+    params = await request.json()
+
+    app = request.app
 
     deviant = params.get('deviant', None)
 
     if deviant is None:
         return JSONHTTPBadRequest(reason='not ok: deviant missing')
     try:
-        resolved = await resolve_deviant(manager, deviant, resolve_cache)
+        resolved = await app['resolver'].resolve(deviant)
         return json_response({'deviant': deviant, 'resolved': resolved})
     except DagrException:
         raise JSONHTTPBadRequest(
             reason='not ok: unable to resolve deviant')
 
 
+async def resolve_batch(request):
+    app = request.app
+    resolve_cache = app['resolve_cache']
+    resolver = app['resolver']
+
+    try:
+        deviants = await request.json()
+    except JSONDecodeError:
+        raise JSONHTTPBadRequest(reason='not ok: JSONDecodeError')
+
+    if not isinstance(deviants, list) or not all(isinstance(d, str) for d in deviants):
+        raise JSONHTTPBadRequest(reason='not ok: expected a list of deviants')
+
+    response = web.StreamResponse(
+        headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+
+    async def write_result(deviant, resolved, error=None):
+        result = {'deviant': deviant, 'resolved': resolved}
+        if error is not None:
+            result['error'] = error
+        await response.write(dumps(result).encode() + b'\n')
+
+    async def lookup(deviant):
+        try:
+            return deviant, await resolver.resolve(deviant), None
+        except DagrException as ex:
+            return deviant, None, str(ex)
+
+    distinct = dict()
+    for d in deviants:
+        distinct.setdefault(d.lower(), d)
+
+    misses = []
+    for deviant in distinct.values():
+        try:
+            cached = resolve_cache.query(deviant)
+        except DagrException as ex:
+            await write_result(deviant, None, str(ex))
+            continue
+        if cached:
+            await write_result(deviant, cached)
+        else:
+            misses.append(deviant)
+
+    logger.info(
+        f"Batch resolve: {len(deviants) - len(misses)} cached, {len(misses)} to resolve")
+    for lookup_result in asyncio.as_completed([lookup(d) for d in misses]):
+        await write_result(*(await lookup_result))
+
+    await response.write_eof()
+    return response
+
+
 async def query_resolve_cache(request):
     params = await request.json()
     resolve_cache = request.app['resolve_cache']
@@ -256,6 +679,48 @@ async def query_resolve_cache(request):
     return json_response({'result': resolve_cache.query_raw(deviant)})
 
 
+async def resolve_cache_changes(request):
+    try:
+        since = int(request.query.get('since', -1))
+    except ValueError:
+        raise JSONHTTPBadRequest(reason='not ok: invalid since')
+    return json_response(request.app['resolve_cache'].changes(since, request.query.get('epoch', None)))
+
+
+async def add_resolve_cache_items(request):
+    resolve_cache = request.app['resolve_cache']
+    items = await request.json()
+
+    if not isinstance(items, list) or not all(isinstance(i, dict) and i.get('deviant') for i in items):
+        raise JSONHTTPBadRequest(reason='not ok: expected a list of items')
+
+    entries = []
+    for item in items:
+        if item.get('negative'):
+            entries.append(resolve_cache.add_negative(
+                item['deviant'], item['negative']))
+        else:
+            entries.append(resolve_cache.add(
+                item['deviant'], deactivated=bool(item.get('deactivated'))))
+    return json_response(entries)
+
+
+async def purge_resolve_cache_items(request):
+    resolve_cache = request.app['resolve_cache']
+    deviants = await request.json() if request.can_read_body else None
+
+    if not deviants is None and not isinstance(deviants, list):
+        deviants = [deviants]
+
+    if request.query.get('negative', '').lower() in ['1', 'true', 'yes']:
+        purged = resolve_cache.purge_negative(deviants)
+    else:
+        purged = len(deviants or [])
+        for d in deviants or []:
+            resolve_cache.purge(d)
+    return json_response({'purged': purged})
+
+
 async def flush_resolve_cache(request):
     resolve_cache = request.app['resolve_cache']
     try:
@@ -274,6 +739,106 @@ async def bulk_get_items(request):
     return json_response(items)
 
 
+async def admission_state(request):
+    return json_response(request.app['admission'].state())
+
+
+async def admission_stream(request):
+    admission = request.app['admission']
+    response = web.StreamResponse(
+        headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+    while not request.app['shutdown'].is_set():
+        await response.write(dumps(admission.state()).encode() + b'\n')
+        await admission.wait_changed(admission.retry_after)
+    return response
+
+
+async def get_metrics(request):
+    app = request.app
+    queue = app['queue']
+    resolve_cache = app['resolve_cache']
+    depth = dict()
+    for item in list(queue.items()):
+        band = (item.mode, Metrics.priority_band(item.priority))
+        depth[band] = depth.get(band, 0) + 1
+    collected = [
+        ('dagr_queue_depth', 'gauge', 'Queued items by mode and priority band',
+         [({'mode': m, 'band': b}, c) for (m, b), c in depth.items()]),
+        ('dagr_queue_ready', 'gauge', 'Queued items ready for dispatch by mode',
+         [({'mode': m}, c) for m, c in queue.mode_counts().items()]),
+        ('dagr_queue_delayed', 'gauge', 'Queued items waiting for not_before',
+         [({}, queue.delayed_count())]),
+        ('dagr_queue_leased', 'gauge', 'Items currently leased to workers',
+         [({}, len(app['leases']))]),
+        ('dagr_queue_waiting', 'gauge', 'Dequeue requests waiting for an item',
+         [({}, app['waiting_count'].value)]),
+        ('dagr_queue_dead_letters', 'gauge', 'Items parked in the dead letter queue',
+         [({}, app['dead_letters'].count())]),
+        ('dagr_queue_writer_backlog', 'gauge', 'Queue cache operations waiting to be written',
+         [({}, app['queue_writer'].backlog)]),
+        ('dagr_queue_journal_pending', 'gauge', 'Journal records waiting for compaction',
+         [({}, app['queue_journal'].pending)]),
+        ('dagr_resolve_inflight', 'gauge', 'Deviant lookups in flight',
+         [({}, app['resolver'].inflight)]),
+        ('dagr_resolve_cache_requests_total', 'counter', 'Resolve cache lookups',
+         [({'result': 'hit'}, resolve_cache.hits), ({'result': 'miss'}, resolve_cache.misses)])
+    ]
+    return web.Response(text=app['metrics'].render(collected), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+def get_stream_params(request):
+    query = request.query
+    try:
+        return {
+            'cursor': loads(urlsafe_b64decode(query['cursor'])) if query.get('cursor') else None,
+            'mode': query.get('mode') or None,
+            'deviant_prefix': query.get('deviant_prefix') or None,
+            'min_priority': int(query['min_priority']) if query.get('min_priority') else None,
+            'max_priority': int(query['max_priority']) if query.get('max_priority') else None,
+            'limit': max(1, min(int(query.get('limit', request.app['STREAM_PAGE_SIZE'])), request.app['STREAM_PAGE_SIZE']))
+        }
+    except ValueError:
+        raise JSONHTTPBadRequest(reason='not ok: invalid stream parameters')
+
+
+async def stream_items(request, scan, serialize, priority_of):
+    params = get_stream_params(request)
+    response = web.StreamResponse(
+        headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+    min_priority = params['min_priority']
+    max_priority = params['max_priority']
+    sent = 0
+    scanned = 0
+    last = None
+    next_cursor = None
+    for sort_key, item in scan(params['cursor'], params['mode'], params['deviant_prefix']):
+        if sent >= params['limit']:
+            next_cursor = urlsafe_b64encode(dumps(last).encode()).decode()
+            break
+        last = sort_key
+        scanned += 1
+        if scanned % 1000 == 0:
+            await asyncio.sleep(0)
+        priority = priority_of(item)
+        if priority is not None and ((min_priority is not None and priority < min_priority) or (max_priority is not None and priority > max_priority)):
+            continue
+        await response.write(dumps(serialize(item)).encode() + b'\n')
+        sent += 1
+    await response.write(dumps({'cursor': next_cursor}).encode() + b'\n')
+    await response.write_eof()
+    return response
+
+
+async def stream_contents(request):
+    return await stream_items(request, request.app['queue'].scan, lambda i: i.params, lambda i: i.priority)
+
+
+async def stream_bulk_items(request):
+    return await stream_items(request, request.app['bulk_cache'].scan, lambda i: i, lambda i: None)
+
+
 async def reload_queue(request):
     await load_cached_queue(request.app)
     return json_response('ok')
@@ -287,22 +852,38 @@ def shutdown_app(request):
 
 async def load_cached_queue(app):
     crawler_cache = app['crawler_cache']
-    queue = app['queue']
+    queue_journal = app['queue_journal']
     queue_slug = app['queue_slug']
-    loaded = [QueueItem(**dict(i)) for i in crawler_cache.query(queue_slug)]
-    logger.info(f"Adding {len(loaded)} items to queue")
-    for d in loaded:
-        await queue.put(d)
-    logger.info(f"Done")
+    async with app['queue_lock']:
+        if queue_journal.replay() > 0:
+            compact_queue_journal(queue_journal, force=True)
+    leased = set(i.key for i in app['leases'].items())
+    cached = list(crawler_cache.query(queue_slug))
+    logger.info(f"Adding {len(cached)} items to queue")
+    t_start = time()
+    for cached_chunk in chunk(cached, app['QUEUE_LOAD_CHUNK_SIZE']):
+        loaded = [QueueItem(**dict(i)) for i in cached_chunk]
+        for d in app['queue'].load([d for d in loaded if not d.key in leased]):
+            requeue_cached_item(app, d)
+        await asyncio.sleep(0)
+    logger.info(f"Done loading queue in {time() - t_start:.2f} seconds")
 
 
 async def start_background_tasks(app):
-    pass
+    app['queue_writer'].start()
+    app['tasks']['reap_leases'] = asyncio.create_task(reap_leases(app))
+    if app['RESOLVE_REFRESH_INTERVAL'] > 0:
+        app['tasks']['refresh_resolve_cache'] = asyncio.create_task(
+            refresh_resolve_cache(app))
+    if app['QUEUE_LAZY_LOAD']:
+        app['tasks']['load_queue'] = asyncio.create_task(
+            load_cached_queue(app))
 
 
 async def cleanup_background_tasks(app):
-    for t in app['tasks']:
+    for t in app['tasks'].values():
         t.cancel()
+    await app['queue_writer'].stop()
 
 
 async def cleanup_caches(app):
@@ -313,6 +894,8 @@ async def cleanup_caches(app):
 
     sessions_cache.clear()
 
+    app['resolver'].shutdown()
+    app['queue_journal'].close()
     app['crawler_cache'].flush()
 
 
@@ -333,26 +916,52 @@ async def run_app():
     resolve_cache = DeviantResolveCache(crawler_cache)
     bulk_cache = BulkCache(crawler_cache)
 
-    queue = asyncio.PriorityQueue()
+    job_stats = JobStats(crawler_cache, environ.get('JOB_STATS_ALPHA', 0.3))
+
+    queue = IndexedQueue(
+        aging=environ.get('QUEUE_AGING_SECONDS', None),
+        weights={m: int(w) for m, w in (i.split(':') for i in environ.get('QUEUE_MODE_WEIGHTS', '').split(',') if i)},
+        cost=job_stats.cost if environ.get('SHORTEST_JOB_FIRST', 'false').lower() in ['1', 'true', 'yes'] else None)
     waiting_count = WaitingCount()
 
     app = web.Application()
     app.router.add_get('/ping', lambda request: json_response('pong'))
     app.router.add_post('/reload', reload_queue)
     app.router.add_post('/url', add_url)
+    app.router.add_post('/url/classify', classify_urls)
     app.router.add_get('/item', get_item)
+    app.router.add_patch('/item', patch_item)
+    app.router.add_delete('/item', delete_item)
+    app.router.add_get('/ws', push_items)
+    app.router.add_get('/item/status', item_status)
+    app.router.add_post('/item/ack', ack_item)
+    app.router.add_post('/item/nack', nack_item)
+    app.router.add_post('/item/extend', extend_item)
+    app.router.add_get('/dlq', dlq_items)
+    app.router.add_post('/dlq', dlq_report)
+    app.router.add_post('/dlq/replay', dlq_replay)
+    app.router.add_post('/item/upgrade', upgrade_item)
     app.router.add_post('/items', add_items)
     app.router.add_get('/resolve', resolve)
+    app.router.add_post('/resolve/batch', resolve_batch)
     app.router.add_get('/resolve/cache/query', query_resolve_cache)
     app.router.add_post('/resolve/cache/flush', flush_resolve_cache)
+    app.router.add_get('/resolve/cache/changes', resolve_cache_changes)
+    app.router.add_post('/resolve/cache/items', add_resolve_cache_items)
+    app.router.add_delete('/resolve/cache/items', purge_resolve_cache_items)
     app.router.add_get(
-        '/count', lambda request: json_response({'count': queue.qsize()}))
+        '/count', lambda request: json_response({'count': queue.qsize(), 'delayed': queue.delayed_count()}))
     app.router.add_get(
         '/waiting', lambda request: json_response({'waiting': waiting_count.value}))
     app.router.add_get(
         '/contents', lambda request: json_response([*app['crawler_cache'].query(app['queue_slug'])]))
+    app.router.add_get('/contents/stream', stream_contents)
     app.router.add_get(
         '/bulk/all', bulk_get_items)
+    app.router.add_get('/bulk/stream', stream_bulk_items)
+    app.router.add_get('/admission', admission_state)
+    app.router.add_get('/admission/stream', admission_stream)
+    app.router.add_get('/metrics', get_metrics)
     app.router.add_post('/shutdown', shutdown_app)
 
     setup(app)
@@ -362,34 +971,85 @@ async def run_app():
     app['tasks'] = {}
     app['manager'] = manager
     app['queue'] = queue
-    app['queue_lock'] = asyncio.Lock()
+    app['metrics'] = Metrics()
+    app['queue_lock'] = app['metrics'].timed_lock()
     app['shutdown'] = asyncio.Event()
     app['sleepmgr'] = SleepMgr(app, 300)
     app['waiting_count'] = waiting_count
+    app['websockets'] = set()
     app['crawler_cache'] = crawler_cache
     app['resolve_cache'] = resolve_cache
+    app['resolver'] = DeviantResolver(manager, resolve_cache)
+    app['RESOLVE_REFRESH_INTERVAL'] = int(
+        environ.get('RESOLVE_REFRESH_INTERVAL', 300))
+    app['RESOLVE_REFRESH_AHEAD'] = int(
+        environ.get('RESOLVE_REFRESH_AHEAD', 43200))
+    app['RESOLVE_REFRESH_BATCH'] = int(environ.get('RESOLVE_REFRESH_BATCH', 5))
+    app['RESOLVE_REFRESH_MIN_HITS'] = int(
+        environ.get('RESOLVE_REFRESH_MIN_HITS', 2))
     app['bulk_cache'] = bulk_cache
+    app['job_stats'] = job_stats
     app['dagr_config'] = config
     app['sessions'] = dict()
 
-    app['regexes'] = {k: re.compile(v)
-                      for k, v in config.get('deviantart.regexes').items()}
-
-    app['regex_priorities'] = config.get('deviantart.regexes.priorities')
-
-    app['regex_max_priority'] = config.get(
-        'deviantart.regexes.params', 'maxpriority')
-
     app['nd_modes'] = config.get('deviantart', 'ndmodes').split(',')
 
+    app['url_classifier'] = UrlClassifier(
+        config.get('deviantart.regexes'),
+        config.get('deviantart.regexes.priorities'),
+        config.get('deviantart.regexes.params', 'maxpriority'),
+        app['nd_modes'])
+
     app['DEQUEUE_TIMEOUT'] = environ.get('DEQUEUE_TIMEOUT', 60)
     logger.log(level=15, msg=f"Dequeue timeout: {app['DEQUEUE_TIMEOUT']}")
 
+    app['admission'] = AdmissionControl(
+        queue,
+        high=environ.get('QUEUE_HIGH_WATERMARK', None),
+        low=environ.get('QUEUE_LOW_WATERMARK', None),
+        mode_limits={m: (int(h), int(l) if l else None) for m, h, l in (
+            (i.split(':') + [None])[:3] for i in environ.get('QUEUE_MODE_WATERMARKS', '').split(',') if i)},
+        retry_after=environ.get('QUEUE_RETRY_AFTER', 30))
+
+    app['DEQUEUE_MAX_BATCH'] = int(environ.get('DEQUEUE_MAX_BATCH', 100))
+    app['QUEUE_LOAD_CHUNK_SIZE'] = int(
+        environ.get('QUEUE_LOAD_CHUNK_SIZE', 10000))
+    app['QUEUE_LAZY_LOAD'] = environ.get(
+        'QUEUE_LAZY_LOAD', '').lower() in ['1', 'true', 'yes']
+
+    app['STREAM_PAGE_SIZE'] = int(environ.get('STREAM_PAGE_SIZE', 1000))
+
+    app['LEASE_TIMEOUT'] = int(environ.get('LEASE_TIMEOUT', 900))
+    app['LEASE_REAP_INTERVAL'] = int(environ.get('LEASE_REAP_INTERVAL', 5))
+    app['leases'] = LeaseManager(app['LEASE_TIMEOUT'])
+    app['DISPATCH_EXCLUSIVE'] = environ.get(
+        'DISPATCH_EXCLUSIVE', 'true').lower() in ['1', 'true', 'yes']
+
+    app['dead_letters'] = DeadLetterQueue(
+        crawler_cache,
+        max_attempts=environ.get('DLQ_MAX_ATTEMPTS', 5),
+        backoff_base=environ.get('DLQ_BACKOFF_BASE', 60),
+        backoff_max=environ.get('DLQ_BACKOFF_MAX', 21600))
+
+    app['queue_journal'] = QueueJournal(
+        crawler_cache, app['queue_slug'],
+        journal_dir=environ.get(
+            'QUEUE_JOURNAL_DIR', config.output_dir.joinpath('.queue_journal')),
+        segment_size=environ.get('QUEUE_JOURNAL_SEGMENT_SIZE', 10000),
+        compact_size=environ.get('QUEUE_JOURNAL_COMPACT_SIZE', 50000))
+
+    app['queue_writer'] = QueueCacheWriter(
+        crawler_cache, app['queue_slug'], app['queue_journal'], app['queue_lock'],
+        batch_size=environ.get('QUEUE_WRITER_BATCH_SIZE', 500),
+        batch_window=environ.get('QUEUE_WRITER_BATCH_WINDOW', 0.5))
+
     app.on_startup.append(start_background_tasks)
+    app.on_shutdown.append(close_websockets)
     app.on_cleanup.append(cleanup_background_tasks)
     app.on_cleanup.append(cleanup_caches)
 
-    await load_cached_queue(app)
+    if not app['QUEUE_LAZY_LOAD']:
+        await load_cached_queue(app)
 
     runner = web.AppRunner(app)
     await runner.setup()
@@ -407,6 +1067,9 @@ async def run_app():
         try:
             await resolve_cache.flush()
             await bulk_cache.flush()
+            await app['dead_letters'].flush()
+            await job_stats.flush()
+            await flush_queue_cache(app)
         except CircuitBreakerError:
             logger.warning('CircuitBreakerError')
         await app['sleepmgr'].sleep()
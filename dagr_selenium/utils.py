@@ -2,18 +2,21 @@ from pybreaker import CircuitBreakerError
 import asyncio
 import logging
 from itertools import islice
+from json import loads
 from os import environ
 from pathlib import Path
 from pprint import pformat, pprint
 from time import time
 
+import requests
 from dagr_revamped.DAGRCache import DAGRCache
 from dagr_revamped.exceptions import DagrCacheLockException, DagrException
 from dagr_revamped.utils import (artist_from_url, get_html_name,
                                  http_post_raw, sleep)
+from requests.exceptions import HTTPError
 from selenium.common.exceptions import NoSuchElementException
 
-from dagr_selenium.DeviantResolveCache import DeviantResolveCache
+from dagr_selenium.RemoteDeviantResolveCache import create_resolve_cache
 from dagr_selenium.BulkCache import BulkCache
 
 logger = logging.getLogger(__name__)
@@ -37,11 +40,19 @@ def get_urls(config):
     queman_waiting_url = environ.get('QUEUEMAN_WAITING_URL', None) or config.get(
         'dagr.plugins.selenium', 'queueman_waiting_url', key_errors=False) or 'http://127.0.0.1:3005/waiting'
 
+    queueman_admission_url = environ.get('QUEUEMAN_ADMISSION_URL', None) or config.get(
+        'dagr.plugins.selenium', 'queueman_admission_url', key_errors=False) or 'http://127.0.0.1:3005/admission'
+
+    queueman_resolve_batch_url = environ.get('QUEUEMAN_RESOLVE_BATCH_URL', None) or config.get(
+        'dagr.plugins.selenium', 'queueman_resolve_batch_url', key_errors=False)
+
     urls = {
         'fetch':            queueman_fetch_url,
         'enqueue':          queueman_enqueue_url,
         'fncache_update':   fncache_update_url,
-        'waiting':          queman_waiting_url
+        'waiting':          queman_waiting_url,
+        'admission':        queueman_admission_url,
+        'resolve_batch':    queueman_resolve_batch_url
     }
 
     logger.info('Queman Urls:')
@@ -50,7 +61,7 @@ def get_urls(config):
     return urls
 
 
-async def is_deactivated(deviant, manager):
+def check_deactivated(deviant, manager):
     browser = manager.get_browser()
     with browser.get_r_context():
         if not deviant.lower() in browser.current_url.lower():
@@ -62,43 +73,81 @@ async def is_deactivated(deviant, manager):
             return False
 
 
+def lookup_deviant(manager, deviant):
+    with manager.get_browser().get_r_context():
+        deviant, _group = manager.get_dagr().resolve_deviant(deviant)
+        return deviant
+
+
+async def run_blocking(executor, func, *args):
+    if executor is None:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
 async def query_resolve_cache(resolve_cache, deviant):
     logger.info('Attempting to resolve %s', deviant)
     try:
         return resolve_cache.query(deviant)
-    except DagrException:
-        logger.warning('Deviant %s is listed as deactivated', deviant)
+    except DagrException as ex:
+        logger.warning('Deviant %s is listed as unavailable: %s', deviant, ex)
         raise
 
 
-async def resolve_query_deviantart(manager, resolve_cache, deviant):
+async def resolve_query_deviantart(manager, resolve_cache, deviant, cache_failures=True, executor=None):
     logger.info('Attempting to resolve %s', deviant)
-    with manager.get_browser().get_r_context():
-        try:
-            deviant, _group = manager.get_dagr().resolve_deviant(deviant)
-            resolve_cache.add(deviant)
-            return deviant
-        except DagrException:
-            if await is_deactivated(deviant, manager):
-                logger.warning('Deviant %s is deactivated', deviant)
-                resolve_cache.add(deviant, deactivated=True)
-                logger.log(15, 'Added %s to deactivated list', deviant)
-                raise
-            logger.warning('Unable to resolve deviant %s', deviant)
+    try:
+        resolved = await run_blocking(executor, lookup_deviant, manager, deviant)
+    except DagrException:
+        if await run_blocking(executor, check_deactivated, deviant, manager):
+            logger.warning('Deviant %s is deactivated', deviant)
+            resolve_cache.add(deviant, deactivated=True)
+            logger.log(15, 'Added %s to deactivated list', deviant)
             raise
+        logger.warning('Unable to resolve deviant %s', deviant)
+        if cache_failures:
+            resolve_cache.add_negative(deviant)
+        raise
+    resolve_cache.add(resolved)
+    return resolved
 
 
 async def resolve_deviant(manager, deviant, resolve_cache=None):
     if resolve_cache is None:
-        resolve_cache = DeviantResolveCache(manager.get_cache())
+        resolve_cache = create_resolve_cache(manager.get_cache())
     if cached_result := await query_resolve_cache(resolve_cache, deviant):
         return cached_result
     return await resolve_query_deviantart(manager, resolve_cache, deviant)
 
 
+def resolve_artists_batch(endpoint, artists):
+    resolved_artists = {}
+    names = {k.lower(): k for k in artists.keys()}
+    with requests.post(endpoint, json=list(names.values()), stream=True, timeout=900) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            result = loads(line)
+            if result.get('resolved') is None:
+                logger.warning('Unable to resolve %s: %s',
+                               result['deviant'], result.get('error'))
+                continue
+            resolved_artists[result['resolved']
+                             ] = artists[names[result['deviant'].lower()]]
+    return resolved_artists
+
+
 async def resolve_artists(manager, artists, flush=True):
+    batch_url = get_urls(manager.get_config())['resolve_batch']
+    if batch_url:
+        try:
+            return resolve_artists_batch(batch_url, artists)
+        except:
+            logger.exception(
+                'Batch resolve failed, falling back to local resolution')
     resolved_artists = {}
-    resolve_cache = DeviantResolveCache(manager.get_cache())
+    resolve_cache = create_resolve_cache(manager.get_cache())
     uncached = {}
 
     for k, v in artists.items():
@@ -250,7 +299,20 @@ async def sort_pages(manager, to_sort, **kwargs):
     return queued_artists if queued_only else list(artists.keys())
 
 
-async def queue_items(crawler_cache, session, endpoint,  mode, deviants, priority=100, full_crawl=False, resolved=None):
+async def post_queue_items(session, endpoint, items):
+    while True:
+        try:
+            return http_post_raw(session=session, endpoint=endpoint, json=items)
+        except HTTPError as ex:
+            if ex.response is None or ex.response.status_code != 429:
+                raise
+            retry_after = int(ex.response.headers.get('Retry-After', 30))
+            logger.info(
+                f"Queue manager is throttling, retrying in {retry_after} seconds")
+            await asyncio.sleep(retry_after)
+
+
+async def queue_items(crawler_cache, session, endpoint,  mode, deviants, priority=100, full_crawl=False, resolved=None, not_before=None):
     cache_slug = f"pending_{mode}"
     if not isinstance(deviants, set):
         deviants = set(deviants)
@@ -259,10 +321,13 @@ async def queue_items(crawler_cache, session, endpoint,  mode, deviants, priorit
     for deviantschunk in chunk(deviants, 5):
         items = [{'mode': mode, 'deviant': d, 'priority': priority,
                   'full_crawl': full_crawl, 'resolved': resolved} for d in deviantschunk]
+        if not not_before is None:
+            for i in items:
+                i['not_before'] = not_before
         logger.info(
             f"Sending {mode} {deviantschunk} to queue manager")
         try:
-            http_post_raw(session=session, endpoint=endpoint, json=items)
+            await post_queue_items(session, endpoint, items)
         except:
             logger.exception('Error while enquing items')
             try:
@@ -270,7 +335,6 @@ async def queue_items(crawler_cache, session, endpoint,  mode, deviants, priorit
                 crawler_cache.flush(cache_slug)
             except:
                 logger.exception('Error while caching pending items')
-            await asyncio.sleep(900)
         else:
             logger.info(
                 f"Pruning cache; removing {deviantschunk} from {cache_slug}")
@@ -5,16 +5,22 @@ from json import dumps
 from os import environ
 from pathlib import Path
 from pprint import pformat
-from threading import Event
+from threading import Event, Thread
+from time import time
 
 from aiofiles.os import exists
 from dagr_revamped.dagr_logging import do_shutdown_tasks
+from dagr_revamped.TCPKeepAliveSession import TCPKeepAliveSession
 from selenium.common.exceptions import (InvalidSessionIdException,
                                         WebDriverException)
 
 from .BackgroundTask import BackgroundTask
 from .functions import (config, flush_errors_to_queue, manager,
-                        queueman_fetch_url, session)
+                        queueman_ack_url, queueman_extend_url,
+                        queueman_fetch_url, queueman_nack_url,
+                        queueman_push_url, session, worker_lease_timeout,
+                        worker_modes)
+from .PushSubscriber import PushSubscriber
 from .QueueItem import QueueItem
 
 env_level = environ.get('dagr.worker.logging.level', None)
@@ -28,17 +34,72 @@ logger = logging.getLogger(__name__)
 
 stop_event = Event()
 
+subscriber = PushSubscriber(
+    queueman_push_url,
+    modes=worker_modes.split(',') if worker_modes else None,
+    lease=worker_lease_timeout) if queueman_push_url else None
+
 
 async def fetch_item():
+    if subscriber is not None:
+        return receive_item()
     try:
-        resp = session.get(queueman_fetch_url, timeout=900)
+        params = {'lease': worker_lease_timeout}
+        if worker_modes:
+            params['modes'] = worker_modes
+        resp = session.get(queueman_fetch_url, params=params, timeout=900)
         resp.raise_for_status()
-        return QueueItem(**(resp.json()))
+        result = resp.json()
+        return QueueItem(**result['item']), result['lease']
     except:
         logger.exception('Error while fetching work item')
+    return None, None
+
+
+def receive_item():
+    message = subscriber.fetch(60)
+    if message is None:
+        logger.log(level=15, msg='No work item pushed')
+        return None, None
+    return QueueItem(**message['item']), message['lease']
+
+
+def keep_lease(lease, done):
+    with TCPKeepAliveSession() as heartbeat_session:
+        while not done.wait(worker_lease_timeout / 3):
+            try:
+                resp = heartbeat_session.post(queueman_extend_url, json={
+                                              'lease': lease}, timeout=60)
+                resp.raise_for_status()
+            except:
+                logger.exception('Error while extending lease')
+
+
+def ack_item(lease, stats=None):
+    try:
+        resp = session.post(queueman_ack_url, json={
+                            'lease': lease, 'stats': stats}, timeout=60)
+        resp.raise_for_status()
+    except:
+        logger.exception('Error while acking work item')
+
+
+def nack_item(lease, error):
+    try:
+        resp = session.post(queueman_nack_url, json={
+                            'lease': lease, 'error': error}, timeout=60)
+        resp.raise_for_status()
+        return True
+    except:
+        logger.exception('Error while reporting failed work item')
+    return False
 
 
-async def process_item(item):
+async def process_item(item, lease=None):
+    done = Event()
+    started = time()
+    if lease is not None:
+        Thread(target=keep_lease, args=(lease, done), daemon=True).start()
     try:
         item.process()
         http_errors = manager.get_dagr().report_http_errors()
@@ -50,6 +111,8 @@ async def process_item(item):
             logger.info('Caught fatal exception')
             manager.session_bad()
         logger.exception('Error while processing item')
+        if lease is not None and nack_item(lease, repr(ex)):
+            return
         try:
             manager.get_cache().update('error_items', item.params)
         except:
@@ -58,6 +121,11 @@ async def process_item(item):
             flush_errors_to_queue()
         except:
             pass
+        return
+    finally:
+        done.set()
+    if lease is not None:
+        ack_item(lease, {'duration': time() - started})
 
 
 async def check_stop_file():
@@ -83,24 +151,32 @@ async def __main__():
     manager.set_stop_check(stop_event.is_set)
     await asyncio.sleep(0)
 
+    if subscriber is not None:
+        await bg_tsk.run(subscriber.run, (stop_event.is_set,))
+        subscriber.request()
+
     with manager.get_dagr() as dagr:
         logger.info('Flushing previous errors')
         flush_errors_to_queue()
         logger.info("Worker ready")
         while manager.session_ok and not stop_event.is_set():
             logger.info("Fetching work item")
-            item = await fetch_item()
+            item, lease = await fetch_item()
             if not item is None:
                 logger.info('Got work item %s', dumps(item.params))
-                await process_item(item)
+                await process_item(item, lease)
                 dagr.print_errors()
                 dagr.print_dl_total()
                 dagr.reset_stats()
-            else:
+                if subscriber is not None:
+                    subscriber.request()
+            elif subscriber is None:
                 logger.warning('Unable to fetch workitem')
                 await asyncio.sleep(30)
     if not stop_event.is_set():
         stop_event.set()
+    if subscriber is not None:
+        subscriber.stop()
     await asyncio.sleep(30)
 
 
@@ -98,6 +98,57 @@ class TestQueueMan(unittest.TestCase):
 
         self.assertTrue(result == 'ok')
 
+    def test_queue_dedup(self):
+        count = None
+        status = None
+        origin = f"http://0.0.0.0:{self.container_port}"
+        try:
+            for priority in [100, 50]:
+                resp = requests.post(f"{origin}/items",
+                                     json=[{"mode": "tag", "mval": "landscape", "priority": priority}])
+                resp.raise_for_status()
+            resp = requests.get(f"{origin}/count")
+            resp.raise_for_status()
+            count = resp.json()['count']
+            resp = requests.get(f"{origin}/item/status",
+                                json={"mode": "tag", "mval": "landscape"})
+            resp.raise_for_status()
+            status = resp.json()
+        except:
+            logging.exception('Failed to queue items')
+            self.containerLogs()
+            raise
+
+        self.assertTrue(count == 1)
+        self.assertTrue(status['queued'])
+        self.assertTrue(status['item']['priority'] == 50)
+
+    def test_patch_delete_item(self):
+        patched = None
+        count = None
+        origin = f"http://0.0.0.0:{self.container_port}"
+        try:
+            resp = requests.post(f"{origin}/items",
+                                 json=[{"mode": "tag", "mval": "landscape", "priority": 50}])
+            resp.raise_for_status()
+            resp = requests.patch(f"{origin}/item",
+                                  json={"mode": "tag", "mval": "landscape", "priority": 150})
+            resp.raise_for_status()
+            patched = resp.json()
+            resp = requests.delete(f"{origin}/item",
+                                   json={"mode": "tag", "mval": "landscape"})
+            resp.raise_for_status()
+            resp = requests.get(f"{origin}/count")
+            resp.raise_for_status()
+            count = resp.json()['count']
+        except:
+            logging.exception('Failed to patch and delete item')
+            self.containerLogs()
+            raise
+
+        self.assertTrue(patched['priority'] == 150)
+        self.assertTrue(count == 0)
+
     def test_queue_urls(self):
         results = []
         endpoint = f"http://0.0.0.0:{self.container_port}/url"
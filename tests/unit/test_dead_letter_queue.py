@@ -0,0 +1,82 @@
+import unittest
+from time import time
+
+from dagr_selenium.DeadLetterQueue import DeadLetterQueue
+from dagr_selenium.QueueItem import QueueItem
+
+
+class MemoryStorage():
+
+    def __init__(self):
+        self.contents = dict()
+
+    def query(self, slug):
+        return list(self.contents.get(slug, set()))
+
+    def update(self, slug, items):
+        self.contents.setdefault(slug, set()).update(items)
+
+    def remove(self, slug, items):
+        self.contents.setdefault(slug, set()).difference_update(items)
+
+    def flush(self, slug):
+        pass
+
+
+class TestDeadLetterQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+        self.dlq = DeadLetterQueue(
+            self.storage, max_attempts=3, backoff_base=60, backoff_max=150)
+        self.item = QueueItem(mode='gallery', deviant='Test-acc')
+
+    def test_backoff(self):
+        for _i in range(20):
+            self.assertTrue(30 <= self.dlq.backoff(1) <= 60)
+            self.assertTrue(60 <= self.dlq.backoff(2) <= 120)
+            self.assertTrue(75 <= self.dlq.backoff(10) <= 150)
+
+    def test_retries_then_parks(self):
+        first = self.dlq.record_failure(self.item, 'first')
+        self.assertEqual(first['attempts'], 1)
+        self.assertFalse(first['dead'])
+        self.assertTrue(time() + 30 <= first['next_eligible'] <= time() + 60)
+        self.assertEqual(self.dlq.query(), [])
+
+        self.dlq.record_failure(self.item, 'second')
+        last = self.dlq.record_failure(self.item, 'third')
+
+        self.assertEqual(last['attempts'], 3)
+        self.assertTrue(last['dead'])
+        self.assertIsNone(last['next_eligible'])
+        self.assertEqual(last['last_error'], 'third')
+        self.assertEqual(self.dlq.count(), 1)
+        self.assertEqual(len(self.storage.query('dead_letter_items')), 1)
+
+    def test_clear_resets_attempts(self):
+        self.dlq.record_failure(self.item, 'first')
+        self.dlq.clear(self.item.key)
+
+        self.assertEqual(self.dlq.query(dead_only=False), [])
+        self.assertEqual(self.dlq.record_failure(
+            self.item, 'again')['attempts'], 1)
+
+    def test_replay_dead_items(self):
+        other = QueueItem(mode='tag', mval='landscape')
+        for _i in range(3):
+            self.dlq.record_failure(self.item, 'failed')
+        self.dlq.record_failure(other, 'failed')
+
+        reloaded = DeadLetterQueue(self.storage, max_attempts=3)
+        self.assertEqual(reloaded.count(), 1)
+
+        records = reloaded.pop_dead()
+        self.assertEqual([QueueItem(**r['item']).key for r in records], [self.item.key])
+        self.assertEqual(reloaded.count(), 0)
+        self.assertEqual(len(reloaded.query(dead_only=False)), 1)
+        self.assertEqual(len(self.storage.query('dead_letter_items')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
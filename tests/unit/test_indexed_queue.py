@@ -0,0 +1,146 @@
+import asyncio
+import unittest
+from time import time
+
+from dagr_selenium.IndexedQueue import IndexedQueue
+from dagr_selenium.QueueItem import QueueItem
+
+
+class TestIndexedQueue(unittest.IsolatedAsyncioTestCase):
+
+    async def test_priority_then_fifo(self):
+        queue = IndexedQueue()
+        for deviant, priority in [('a', 100), ('b', 50), ('c', 100)]:
+            await queue.put(QueueItem(mode='gallery', deviant=deviant, priority=priority))
+
+        self.assertEqual([queue.get_nowait().deviant for _i in range(3)], [
+                         'b', 'a', 'c'])
+
+    async def test_cost_only_breaks_priority_ties(self):
+        costs = {'a': 10000, 'b': 5, 'c': 1}
+        queue = IndexedQueue(cost=lambda item: costs[item.deviant])
+        for deviant, priority in [('a', 50), ('b', 100), ('c', 100)]:
+            await queue.put(QueueItem(mode='gallery', deviant=deviant, priority=priority))
+
+        self.assertEqual([queue.get_nowait().deviant for _i in range(3)], [
+                         'a', 'c', 'b'])
+
+    async def test_merge_keeps_single_entry(self):
+        queue = IndexedQueue()
+        await queue.put(QueueItem(mode='gallery', deviant='foo'))
+        await queue.put(QueueItem(mode='gallery', deviant='foo', full_crawl=True))
+
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.mode_counts(), {'gallery': 1})
+        self.assertTrue(queue.get_nowait().full_crawl)
+        with self.assertRaises(asyncio.QueueEmpty):
+            queue.get_nowait()
+
+    async def test_delayed_merge_keeps_single_entry(self):
+        queue = IndexedQueue()
+        not_before = time() + 60
+        await queue.put(QueueItem(mode='gallery', deviant='foo', not_before=not_before))
+        await queue.put(QueueItem(mode='gallery', deviant='foo', not_before=not_before, full_crawl=True))
+
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.delayed_count(), 1)
+        self.assertTrue(queue.query(('gallery', 'foo', None)).full_crawl)
+
+    async def test_delayed_merge_ages_from_queued_at(self):
+        queue = IndexedQueue(aging=60)
+        t_now = time()
+        await queue.put(QueueItem(mode='gallery', deviant='bar', queued_at=t_now - 60))
+        await queue.put(QueueItem(mode='gallery', deviant='foo',
+                                  queued_at=t_now - 120, not_before=t_now + 3600))
+        await queue.put(QueueItem(mode='gallery', deviant='foo'))
+
+        self.assertEqual(queue.delayed_count(), 0)
+        self.assertEqual(queue.get_nowait().deviant, 'foo')
+
+    async def test_exclude_skips_without_reordering(self):
+        queue = IndexedQueue()
+        for deviant in ['foo', 'bar', 'baz']:
+            await queue.put(QueueItem(mode='gallery', deviant=deviant))
+
+        self.assertEqual(queue.get_nowait(exclude={'foo'}).deviant, 'bar')
+        self.assertEqual(queue.get_nowait().deviant, 'foo')
+        with self.assertRaises(asyncio.QueueEmpty):
+            queue.get_nowait(exclude={'baz'})
+
+    async def test_exclude_ignores_no_browser_modes(self):
+        queue = IndexedQueue()
+        await queue.put(QueueItem(mode='art', deviant='foo', mval='art-1'))
+        await queue.put(QueueItem(mode='gallery', deviant='foo'))
+
+        self.assertEqual(queue.get_nowait(exclude={'foo'}).mode, 'art')
+        with self.assertRaises(asyncio.QueueEmpty):
+            queue.get_nowait(exclude={'foo'})
+
+    async def test_parked_entries_return_when_released(self):
+        queue = IndexedQueue()
+        for mval in ['a', 'b']:
+            await queue.put(QueueItem(mode='tag', mval=mval))
+        await queue.put(QueueItem(mode='gallery', deviant='foo'))
+        await queue.put(QueueItem(mode='favs', deviant='foo', priority=10))
+        busy = {'foo'}
+
+        self.assertEqual([queue.get_nowait(exclude=busy).mval for _i in range(2)], [
+                         'a', 'b'])
+        with self.assertRaises(asyncio.QueueEmpty):
+            queue.get_nowait(exclude=busy)
+        queue.remove(('gallery', 'foo', None))
+
+        busy.clear()
+        self.assertEqual(queue.get_nowait(exclude=busy).mode, 'favs')
+        with self.assertRaises(asyncio.QueueEmpty):
+            queue.get_nowait()
+        self.assertEqual(queue.qsize(), 0)
+
+    async def test_wakeup_is_passed_on_by_excluded_getter(self):
+        queue = IndexedQueue()
+        busy = {'foo'}
+        excluded = asyncio.create_task(queue.get(exclude=busy))
+        await asyncio.sleep(0)
+        eligible = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+
+        await queue.put(QueueItem(mode='gallery', deviant='foo'))
+
+        self.assertEqual((await asyncio.wait_for(eligible, 1)).deviant, 'foo')
+        self.assertFalse(excluded.done())
+        excluded.cancel()
+
+    async def test_excluded_getter_keeps_its_place(self):
+        queue = IndexedQueue()
+        busy = {'foo'}
+        first = asyncio.create_task(queue.get(exclude=busy))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+        await queue.put(QueueItem(mode='gallery', deviant='foo'))
+        await asyncio.wait_for(second, 1)
+        third = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+
+        await queue.put(QueueItem(mode='gallery', deviant='bar'))
+
+        self.assertEqual((await asyncio.wait_for(first, 1)).deviant, 'bar')
+        self.assertFalse(third.done())
+        third.cancel()
+
+    async def test_notify_all_rechecks_exclusions(self):
+        queue = IndexedQueue()
+        busy = {'foo'}
+        getter = asyncio.create_task(queue.get(exclude=busy))
+        await queue.put(QueueItem(mode='gallery', deviant='foo'))
+        await asyncio.sleep(0)
+        self.assertFalse(getter.done())
+
+        busy.clear()
+        queue.notify_all()
+
+        self.assertEqual((await asyncio.wait_for(getter, 1)).deviant, 'foo')
+
+
+if __name__ == '__main__':
+    unittest.main()
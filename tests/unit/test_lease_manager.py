@@ -0,0 +1,58 @@
+import unittest
+from time import sleep
+
+from dagr_selenium.LeaseManager import LeaseManager
+from dagr_selenium.QueueItem import QueueItem
+
+
+class TestLeaseManager(unittest.TestCase):
+
+    def test_grant_and_release(self):
+        leases = LeaseManager()
+        item = QueueItem(mode='gallery', deviant='Test-acc')
+        lease_id, _expiry = leases.grant(item)
+
+        self.assertIn(lease_id, leases)
+        self.assertIs(leases.get(lease_id), item)
+        self.assertEqual(list(leases.busy), ['test-acc'])
+
+        self.assertIs(leases.release(lease_id), item)
+        self.assertIsNone(leases.release(lease_id))
+        self.assertNotIn(lease_id, leases)
+        self.assertEqual(list(leases.busy), [])
+
+    def test_expired_lease_is_redelivered_once(self):
+        leases = LeaseManager()
+        item = QueueItem(mode='gallery', deviant='Test-acc')
+        lease_id, _expiry = leases.grant(item, timeout=0.05)
+        sleep(0.1)
+
+        self.assertEqual(leases.pop_expired(), [item])
+        self.assertEqual(leases.pop_expired(), [])
+        self.assertNotIn(lease_id, leases)
+        self.assertEqual(list(leases.busy), [])
+        self.assertIsNone(leases.extend(lease_id))
+
+    def test_extend_postpones_expiry(self):
+        leases = LeaseManager()
+        item = QueueItem(mode='gallery', deviant='Test-acc')
+        lease_id, _expiry = leases.grant(item, timeout=0.05)
+        leases.extend(lease_id, timeout=60)
+        sleep(0.1)
+
+        self.assertEqual(leases.pop_expired(), [])
+        self.assertIn(lease_id, leases)
+
+    def test_busy_counts_leases_per_deviant(self):
+        leases = LeaseManager()
+        first, _expiry = leases.grant(QueueItem(mode='gallery', deviant='Test-acc'))
+        leases.grant(QueueItem(mode='favs', deviant='test-acc'))
+        leases.grant(QueueItem(mode='tag', mval='landscape'))
+        leases.grant(QueueItem(mode='art', deviant='Other-acc', mval='art-1'))
+        leases.release(first)
+
+        self.assertEqual(list(leases.busy), ['test-acc'])
+
+
+if __name__ == '__main__':
+    unittest.main()
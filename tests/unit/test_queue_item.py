@@ -0,0 +1,25 @@
+import unittest
+
+from dagr_selenium.QueueItem import QueueItem
+
+
+class TestQueueItem(unittest.TestCase):
+
+    def test_unset_schedule_keys_are_dropped(self):
+        item = QueueItem(mode='gallery', deviant='Test-acc',
+                         priority=100, not_before=None, queued_at=None)
+
+        self.assertEqual(item.raw_params, {
+                         'mode': 'gallery', 'deviant': 'Test-acc', 'priority': 100})
+        self.assertIsNone(item.not_before)
+
+    def test_raw_params_kept_when_normalised(self):
+        item = QueueItem(mode='Gallery', deviant='Test-acc', not_before='10')
+
+        self.assertEqual(item.raw_params, {
+                         'mode': 'Gallery', 'deviant': 'Test-acc', 'not_before': '10'})
+        self.assertEqual(item.params['not_before'], 10.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
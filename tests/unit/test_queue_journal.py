@@ -0,0 +1,93 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dagr_selenium.QueueJournal import QueueJournal
+
+
+class MemoryStorage():
+
+    def __init__(self):
+        self.contents = dict()
+        self.flushed = 0
+
+    def query(self, slug):
+        return list(self.contents.get(slug, []))
+
+    def update(self, slug, item):
+        items = self.contents.setdefault(slug, [])
+        if not item in items:
+            items.append(item)
+
+    def remove(self, slug, item):
+        items = self.contents.setdefault(slug, [])
+        if item in items:
+            items.remove(item)
+
+    def flush(self, slug):
+        self.flushed += 1
+
+
+class TestQueueJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.journal_dir = Path(self.tmp_dir.name).joinpath('journal')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_journal(self):
+        journal = QueueJournal(MemoryStorage(), 'queue',
+                               self.journal_dir, segment_size=2)
+        for mval in ['a', 'b', 'c']:
+            journal.add({'mode': 'tag', 'mval': mval})
+        journal.remove({'mode': 'tag', 'mval': 'a'})
+        journal.close()
+        return journal
+
+    def test_replay_after_crash(self):
+        self.write_journal()
+        with self.journal_dir.joinpath('segment-00000002.jsonl').open('a') as fh:
+            fh.write('{"op": "add", "item": {"mode"')
+
+        storage = MemoryStorage()
+        journal = QueueJournal(storage, 'queue', self.journal_dir)
+        applied = journal.replay()
+
+        self.assertEqual(applied, 4)
+        self.assertEqual(journal.pending, 4)
+        self.assertEqual(storage.query('queue'), [
+            {'mode': 'tag', 'mval': 'b'}, {'mode': 'tag', 'mval': 'c'}])
+
+    def test_replay_continues_segment_numbering(self):
+        self.write_journal()
+        journal = QueueJournal(MemoryStorage(), 'queue', self.journal_dir)
+        journal.replay()
+        journal.add({'mode': 'tag', 'mval': 'd'})
+        journal.close()
+
+        self.assertEqual(sorted(p.name for p in self.journal_dir.glob('*.jsonl')), [
+            'segment-00000001.jsonl', 'segment-00000002.jsonl', 'segment-00000003.jsonl'])
+
+    def test_compact(self):
+        storage = MemoryStorage()
+        journal = QueueJournal(storage, 'queue', self.journal_dir,
+                               segment_size=2, compact_size=3)
+        for mval in ['a', 'b']:
+            journal.add({'mode': 'tag', 'mval': mval})
+        self.assertFalse(journal.needs_compact)
+        journal.remove({'mode': 'tag', 'mval': 'a'})
+        self.assertTrue(journal.needs_compact)
+
+        journal.compact()
+
+        self.assertEqual(storage.flushed, 1)
+        self.assertEqual(journal.pending, 0)
+        self.assertEqual(list(self.journal_dir.glob('*.jsonl')), [])
+        self.assertEqual(QueueJournal(
+            MemoryStorage(), 'queue', self.journal_dir).replay(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()